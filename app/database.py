@@ -1,11 +1,25 @@
+import asyncio
 import logging
-from contextlib import contextmanager
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import NamedTuple, Optional
 
-import pyodbc
 from fastapi import HTTPException
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, select, text
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import selectinload, sessionmaker
+from sqlmodel import SQLModel
+
+from app.models import Persona, normalize_phone, phone_variants
+
+try:
+    import pyodbc
+except ImportError:
+    # Без драйвера ODBC доступны только другие БД, например SQLite для замеров
+    pyodbc = None
 
 logging.basicConfig(
     level=logging.INFO,
@@ -13,22 +27,224 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-engine = create_engine(
+DEFAULT_DATABASE_URL = (
     "mssql+pyodbc://(localdb)\\MSSQLLocalDB/TAXI?"
     "driver=ODBC+Driver+18+for+SQL+Server&TrustServerCertificate=yes"
 )
-Session = sessionmaker(bind=engine)
+ENV_PREFIX = 'TAXI_DB_'
+
+# Асинхронные драйверы для синхронных из TAXI_DB_URL
+ASYNC_DRIVERS = {'pyodbc': 'aioodbc', 'pysqlite': 'aiosqlite'}
+
+_integrity_errors = (IntegrityError,) if pyodbc is None else (IntegrityError, pyodbc.IntegrityError)
+
+
+class EngineSettings(NamedTuple):
+    url: str = DEFAULT_DATABASE_URL
+    # По умолчанию - URL с асинхронным драйвером вместо синхронного
+    async_url: Optional[str] = None
+    pool_size: int = 10
+    max_overflow: int = 20
+    pool_timeout: int = 30
+    pool_recycle: int = 1800
+    pre_ping: bool = True
+    fast_executemany: bool = True
+    isolation_level: Optional[str] = None
+    # Сколько соединений открыть при старте API, по умолчанию - весь постоянный пул
+    warm_connections: Optional[int] = None
+
+
+def engine_settings() -> EngineSettings:
+    # Настройки из переменных окружения TAXI_DB_URL, TAXI_DB_POOL_SIZE, ...
+    settings = {}
+    for name, default in EngineSettings._field_defaults.items():
+        value = os.environ.get(ENV_PREFIX + name.upper())
+        if value is None or value == '':
+            continue
+        if name in ('url', 'async_url', 'isolation_level'):
+            settings[name] = value
+        elif name in ('pre_ping', 'fast_executemany'):
+            settings[name] = _env_bool(name, value)
+        else:
+            settings[name] = _env_int(name, value)
+    return EngineSettings(**settings)
+
+
+def make_engine(settings: EngineSettings) -> Engine:
+    url = make_url(settings.url)
+    return create_engine(url, **_engine_options(url, settings))
+
+
+def make_async_engine(settings: EngineSettings) -> AsyncEngine:
+    if settings.async_url:
+        url = make_url(settings.async_url)
+    else:
+        url = make_url(settings.url)
+        driver = ASYNC_DRIVERS.get(url.get_driver_name())
+        if driver is None:
+            raise ValueError(f"Нет асинхронного драйвера для {url.drivername}, "
+                             f"задайте {ENV_PREFIX}ASYNC_URL")
+        url = url.set(drivername=f"{url.get_backend_name()}+{driver}")
+    return create_async_engine(url, **_engine_options(url, settings))
+
+
+def _engine_options(url, settings: EngineSettings) -> dict:
+    options = {'pool_pre_ping': settings.pre_ping, 'pool_recycle': settings.pool_recycle}
+    if settings.isolation_level:
+        options['isolation_level'] = settings.isolation_level
+    if url.get_driver_name() in ('pyodbc', 'aioodbc'):
+        options['fast_executemany'] = settings.fast_executemany
+    if not _in_memory(url):
+        # SQLite в памяти живёт в одном соединении, размеров пула у него нет
+        options.update(pool_size=settings.pool_size, max_overflow=settings.max_overflow,
+                       pool_timeout=settings.pool_timeout)
+    return options
+
+
+def _in_memory(url) -> bool:
+    return url.get_backend_name() == 'sqlite' and (
+        url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+    )
+
+
+def _env_int(name: str, value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+    if number < 0:
+        raise ValueError(f"{ENV_PREFIX}{name.upper()}: ожидалось неотрицательное число, получено: {value}")
+    return number
+
+
+def _env_bool(name: str, value: str) -> bool:
+    if value.lower() in ('1', 'true', 'yes', 'да'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'нет'):
+        return False
+    raise ValueError(f"{ENV_PREFIX}{name.upper()}: ожидалось true или false, получено: {value}")
+
+
+settings = engine_settings()
+
+# Движки создаются при первом обращении: импорт модуля не требует драйвера БД
+# (замеры ETL на временной SQLite работают без pyodbc), а ETL и скрипты без драйверов
+# aiosqlite/aioodbc не создают асинхронный движок. После commit асинхронные объекты
+# не истекают, иначе чтение их полей потребовало бы неявного запроса к БД
+engine: Optional[Engine] = None
+Session = sessionmaker()
+async_engine: Optional[AsyncEngine] = None
+AsyncSession = async_sessionmaker(expire_on_commit=False)
+
+
+def get_engine() -> Engine:
+    global engine
+    if engine is None:
+        engine = make_engine(settings)
+        Session.configure(bind=engine)
+    return engine
+
+
+def bind_engine(new_engine: Optional[Engine]) -> Optional[Engine]:
+    # Переключает сессии и ETL на другую БД (например, временную SQLite для замеров),
+    # возвращает прежний движок (None, если он ещё не создавался), чтобы его можно было вернуть
+    global engine
+    previous = engine
+    engine = new_engine
+    Session.configure(bind=new_engine)
+    return previous
+
+
+def get_async_engine() -> AsyncEngine:
+    global async_engine
+    if async_engine is None:
+        async_engine = make_async_engine(settings)
+        AsyncSession.configure(bind=async_engine)
+    return async_engine
+
+
+def warm_pool(connections: Optional[int] = None):
+    # Соединения открываются при старте, чтобы первые запросы после выкладки
+    # не ждали подключения к БД. Закрытые соединения остаются в пуле
+    engine = get_engine()
+    connections = _warm_count(engine.url, connections)
+    start = time.perf_counter()
+    opened = []
+    try:
+        for _ in range(connections):
+            connection = engine.connect()
+            opened.append(connection)
+            connection.execute(text('SELECT 1'))
+    finally:
+        for connection in opened:
+            connection.close()
+    logger.info(f"Пул соединений прогрет: {len(opened)} соединений за {time.perf_counter() - start:.2f} сек")
+
+
+async def warm_async_pool(connections: Optional[int] = None):
+    engine = get_async_engine()
+    connections = _warm_count(engine.url, connections)
+    start = time.perf_counter()
+
+    async def connect():
+        connection = await engine.connect()
+        try:
+            await connection.execute(text('SELECT 1'))
+        except BaseException:
+            await connection.close()
+            raise
+        return connection
+
+    # Соединения открываются одновременно, при ошибке открытые возвращаются в пул
+    results = await asyncio.gather(*[connect() for _ in range(connections)], return_exceptions=True)
+    opened = [result for result in results if not isinstance(result, BaseException)]
+    for connection in opened:
+        await connection.close()
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    logger.info(f"Асинхронный пул прогрет: {len(opened)} соединений за {time.perf_counter() - start:.2f} сек")
+
+
+def _warm_count(url, connections: Optional[int]) -> int:
+    if connections is None:
+        connections = settings.pool_size if settings.warm_connections is None else settings.warm_connections
+    return min(connections, 1) if _in_memory(url) else connections
+
+
+def dispose_engine():
+    if engine is not None:
+        engine.dispose()
+
+
+async def dispose_async_engine():
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+def check_indexes():
+    # Индексы моделей создаёт create_all, в существующую БД их добавляют скрипты migrations/.
+    # Здесь схема только читается: без индекса по телефону поиск персоны сканирует таблицу
+    inspector = inspect(get_engine())
+    missing = []
+    for table in SQLModel.metadata.tables.values():
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        missing += [index.name for index in table.indexes if index.name not in existing]
+    if missing:
+        logger.warning(f"В БД нет индексов: {', '.join(missing)}. Примените скрипты из каталога migrations")
+    return missing
 
 
 @contextmanager
 def session_scope():
+    get_engine()
     session = Session()
     try:
         yield session
     except HTTPException:
         session.rollback()
         raise
-    except (IntegrityError, pyodbc.IntegrityError) as e:
+    except _integrity_errors as e:
         session.rollback()
         logger.error(f"IntegrityError: {e}")
         raise HTTPException(
@@ -53,6 +269,40 @@ def session_scope():
         session.close()
 
 
+@asynccontextmanager
+async def async_session_scope():
+    get_async_engine()
+    session = AsyncSession()
+    try:
+        yield session
+    except HTTPException:
+        await session.rollback()
+        raise
+    except _integrity_errors as e:
+        await session.rollback()
+        logger.error(f"IntegrityError: {e}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Ошибка целостности данных: {e}"
+        )
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"SQLAlchemyError: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Внутренняя ошибка сервера: {e}"
+        )
+    except Exception as e:
+        await session.rollback()
+        logger.error(f"Unexpected error: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Внутренняя ошибка сервера: {e}"
+        )
+    finally:
+        await session.close()
+
+
 def create_entity(entity):
     with session_scope() as session:
         return create_entity_s(session, entity)
@@ -97,6 +347,13 @@ def get_entities_s(session, entity_class, key=None):
     return session.query(entity_class).all()
 
 
+def find_persona_s(session, phone: str):
+    # Персона с тем же номером телефона в любом написании, поиск по индексу
+    digits = normalize_phone(phone)
+    query = select(Persona).where(Persona.phone.in_(phone_variants(digits))).order_by(Persona.id)
+    return session.scalars(query).first()
+
+
 def update_entity_s(session, entity_class, key, update_data):
     logger.info(f"Обновление {entity_class.__tablename__} с ключом {key}, данные: {update_data}")
     entity = session.get(entity_class, key)
@@ -127,3 +384,93 @@ def delete_entity_s(session, entity_class, key):
     session.commit()
     logger.info(f"Успешно удалена сущность {entity_class.__tablename__} с ключом {key}")
     return True
+
+
+# Асинхронные версии для роутеров с async def. Связи в асинхронной сессии не
+# подгружаются при обращении к атрибуту, нужные загружаются заранее через options
+
+
+async def acreate_entity(entity):
+    async with async_session_scope() as session:
+        return await acreate_entity_s(session, entity)
+
+
+async def aget_entities(entity_class, key=None):
+    async with async_session_scope() as session:
+        return await aget_entities_s(session, entity_class, key)
+
+
+async def aupdate_entity(entity_class, key, update_data):
+    async with async_session_scope() as session:
+        return await aupdate_entity_s(session, entity_class, key, update_data)
+
+
+async def adelete_entity(entity_class, key):
+    async with async_session_scope() as session:
+        return await adelete_entity_s(session, entity_class, key)
+
+
+async def acreate_entity_s(session, entity):
+    logger.info(f"Создание сущности {entity.__tablename__}")
+    session.add(entity)
+    await session.commit()
+    await session.refresh(entity)
+    logger.info(f"Успешно создана сущность {entity.__tablename__}")
+    return entity
+
+
+async def aget_entities_s(session, entity_class, key=None, options=()):
+    if key is not None:
+        logger.info(f"Получение {entity_class.__tablename__} с ключом {key}")
+        entity = await session.get(entity_class, key, options=options)
+        if not entity:
+            raise HTTPException(
+                status_code=404,
+                detail=f"{entity_class.__tablename__} с ключом {key} не найден"
+            )
+        return entity
+
+    logger.info(f"Получение всех сущностей {entity_class.__tablename__}")
+    return list((await session.scalars(select(entity_class).options(*options))).all())
+
+
+async def afind_persona_s(session, phone: str):
+    # Роли персоны загружаются сразу: по ним проверяют, есть ли уже клиент или водитель
+    digits = normalize_phone(phone)
+    query = (select(Persona)
+             .where(Persona.phone.in_(phone_variants(digits)))
+             .options(selectinload(Persona.client), selectinload(Persona.driver))
+             .order_by(Persona.id))
+    return (await session.scalars(query)).first()
+
+
+async def aupdate_entity_s(session, entity_class, key, update_data):
+    logger.info(f"Обновление {entity_class.__tablename__} с ключом {key}, данные: {update_data}")
+    entity = await session.get(entity_class, key)
+    if not entity:
+        raise HTTPException(
+            status_code=404,
+            detail=f"{entity_class.__tablename__} с ID {key} не найден"
+        )
+
+    for field, value in update_data.items():
+        if value is not None:
+            setattr(entity, field, value)
+    await session.commit()
+    logger.info(f"Успешно обновлена сущность {entity_class.__tablename__} с ключом {key}")
+    return entity
+
+
+async def adelete_entity_s(session, entity_class, key):
+    logger.info(f"Удаление {entity_class.__tablename__} с ключом {key}")
+    entity = await session.get(entity_class, key)
+    if not entity:
+        raise HTTPException(
+            status_code=404,
+            detail=f"{entity_class.__tablename__} с ID {key} не найден"
+        )
+
+    await session.delete(entity)
+    await session.commit()
+    logger.info(f"Успешно удалена сущность {entity_class.__tablename__} с ключом {key}")
+    return True
@@ -0,0 +1,224 @@
+import json
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from graphlib import CycleError, TopologicalSorter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Type
+
+from sqlmodel import SQLModel
+
+from app.etl.extractor import FILE_FORMATS, detect_format
+from app.etl.loader import ETLStats
+from app.etl.mappings import LINE, TABLE_MODELS
+from app.models import Client, Driver, Persona
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS = 2
+
+
+class ImportJob(NamedTuple):
+    file_path: str
+    table_name: str
+    file_format: Optional[str] = None
+    mode: str = 'insert'
+    upsert_key: Optional[List[str]] = None
+
+    @property
+    def model_class(self) -> Type[SQLModel]:
+        return TABLE_MODELS[self.table_name.lower()]
+
+
+def read_manifest(manifest_path: str) -> List[ImportJob]:
+    # Манифест - JSON-список: [{"file": "cars.csv", "table": "cars", "format": ..., "mode": ..., "key": [...]}]
+    # Относительные пути считаются от каталога манифеста
+    base = Path(manifest_path).parent
+    with open(manifest_path, encoding='utf-8') as file:
+        entries = json.load(file)
+
+    jobs = []
+    for i, entry in enumerate(entries, 1):
+        if 'file' not in entry or 'table' not in entry:
+            raise ValueError(f"Запись {i} манифеста должна содержать поля 'file' и 'table'")
+        key = entry.get('key')
+        if entry.get('mode', 'insert') not in ('insert', 'upsert'):
+            raise ValueError(f"Запись {i} манифеста: неизвестный режим {entry['mode']}")
+        jobs.append(ImportJob(
+            file_path=str(base / entry['file']),
+            table_name=entry['table'],
+            file_format=entry.get('format'),
+            mode=entry.get('mode', 'insert'),
+            upsert_key=[key] if isinstance(key, str) else key,
+        ))
+
+    _check_tables(jobs)
+    return jobs
+
+
+def scan_directory(directory: str) -> List[ImportJob]:
+    # Таблица определяется по имени файла: cars.csv, водители.xlsx, orders.csv.gz
+    jobs = []
+    for path in sorted(Path(directory).iterdir()):
+        file_format = detect_format(str(path))
+        if not path.is_file() or file_format not in FILE_FORMATS:
+            continue
+        table_name = path.name[:-len(file_format) - 1]
+        if table_name.lower() not in TABLE_MODELS:
+            logger.warning(f"Файл {path.name} пропущен: нет таблицы {table_name}")
+            continue
+        jobs.append(ImportJob(str(path), table_name))
+
+    if not jobs:
+        raise ValueError(f"В каталоге {directory} нет файлов для импорта")
+    return jobs
+
+
+def dependency_graph(jobs: List[ImportJob]) -> Dict[int, Set[int]]:
+    # Импорт зависит от импортов таблиц, на которые ссылаются его внешние ключи.
+    # Таблицы вне пакета считаются уже загруженными
+    parents = {}
+    for index, job in enumerate(jobs):
+        referenced = {fk.column.table.name for fk in job.model_class.__table__.foreign_keys}
+        referenced -= _loaded_tables(job.model_class)
+        parents[index] = {
+            other for other, parent in enumerate(jobs)
+            if other != index and referenced & _loaded_tables(parent.model_class)
+        }
+    return parents
+
+
+def _loaded_tables(model_class: Type[SQLModel]) -> Set[str]:
+    # Персоны загружаются вместе с клиентами и водителями
+    if model_class is Client or model_class is Driver:
+        return {model_class.__tablename__, Persona.__tablename__}
+    return {model_class.__tablename__}
+
+
+def _check_tables(jobs: List[ImportJob]):
+    unknown = [job.table_name for job in jobs if job.table_name.lower() not in TABLE_MODELS]
+    if unknown:
+        raise ValueError(f"Неизвестные таблицы: {', '.join(unknown)}. "
+                         f"Доступные: {', '.join(TABLE_MODELS.keys())}")
+
+
+class BatchReport:
+    def __init__(self):
+        self.entries: List[Dict[str, Any]] = []
+        self.start_time = datetime.now()
+        self.end_time = None
+
+    def add(self, job: ImportJob, status: str, stats: Optional[ETLStats] = None,
+            error: Optional[str] = None):
+        self.entries.append({'job': job, 'status': status, 'stats': stats, 'error': error})
+
+    def finish(self):
+        self.end_time = datetime.now()
+
+    def get_duration(self) -> float:
+        if self.end_time:
+            return (self.end_time - self.start_time).total_seconds()
+        return 0
+
+    @property
+    def total_rows(self) -> int:
+        return sum(entry['stats'].total_rows for entry in self.entries if entry['stats'])
+
+    @property
+    def success_count(self) -> int:
+        return sum(entry['stats'].success_count for entry in self.entries if entry['stats'])
+
+    @property
+    def unchanged_count(self) -> int:
+        return sum(entry['stats'].unchanged_count for entry in self.entries if entry['stats'])
+
+    @property
+    def error_count(self) -> int:
+        return sum(entry['stats'].error_count for entry in self.entries if entry['stats'])
+
+    @property
+    def failed_count(self) -> int:
+        return sum(1 for entry in self.entries if entry['status'] != 'ok')
+
+    def __str__(self):
+        duration = self.get_duration()
+        lines = [LINE, "ПАКЕТНЫЙ ИМПОРТ", LINE]
+
+        for entry in self.entries:
+            job, stats = entry['job'], entry['stats']
+            line = f"{job.model_class.__tablename__:15} {Path(job.file_path).name:25} {entry['status']:8}"
+            if stats is not None:
+                line += (f" строк: {stats.total_rows}, загружено: {stats.success_count}, "
+                         f"ошибок: {stats.error_count}, {stats.get_duration():.2f} сек, "
+                         f"{stats.get_rows_per_second():.1f} строк/сек")
+            else:
+                line += f" {entry['error']}"
+            lines.append(line)
+
+        rows_per_second = self.success_count / duration if duration > 0 else 0
+        lines += [
+            LINE,
+            f"Файлов: {len(self.entries)}, не загружено: {self.failed_count}",
+            f"Всего строк обработано: {self.total_rows}",
+            f"Успешно загружено: {self.success_count}",
+            f"Ошибок: {self.error_count}",
+            f"Время выполнения: {duration:.2f} сек",
+            f"Скорость загрузки: {rows_per_second:.1f} строк/сек",
+            LINE,
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def run_batch(jobs: List[ImportJob], run_import: Callable[[ImportJob], ETLStats],
+              max_jobs: int = DEFAULT_JOBS) -> BatchReport:
+    # Независимые импорты идут параллельно, зависимый стартует после коммита всех родителей.
+    # Если родитель упал, его потомки пропускаются
+    parents = dependency_graph(jobs)
+    sorter = TopologicalSorter(parents)
+    try:
+        sorter.prepare()
+    except CycleError as e:
+        tables = ', '.join(dict.fromkeys(jobs[index].table_name for index in e.args[1]))
+        raise ValueError(f"Циклическая зависимость между таблицами: {tables}")
+
+    report = BatchReport()
+    failed: Set[int] = set()
+    running = {}
+
+    logger.info(f"Пакетный импорт {len(jobs)} файлов (параллельно: {max_jobs})")
+
+    with ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='etl-import') as executor:
+        while sorter.is_active():
+            for index in sorter.get_ready():
+                job = jobs[index]
+                if parents[index] & failed:
+                    logger.error(f"Импорт {job.file_path} пропущен: не загружена родительская таблица")
+                    report.add(job, 'skipped', error="не загружена родительская таблица")
+                    failed.add(index)
+                    sorter.done(index)
+                    continue
+
+                logger.info(f"Старт импорта {job.file_path} в таблицу {job.model_class.__tablename__}")
+                running[executor.submit(run_import, job)] = index
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index = running.pop(future)
+                job = jobs[index]
+                try:
+                    stats = future.result()
+                    report.add(job, 'ok', stats)
+                    logger.info(f"Импорт {job.file_path} завершён: "
+                                f"{stats.success_count}/{stats.total_rows} строк")
+                except Exception as e:
+                    logger.error(f"Импорт {job.file_path} завершился ошибкой: {e}")
+                    report.add(job, 'failed', error=str(e))
+                    failed.add(index)
+                sorter.done(index)
+
+    report.finish()
+
+    return report
@@ -0,0 +1,452 @@
+import gc
+import json
+import logging
+import platform
+import shutil
+import subprocess
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from sqlmodel import SQLModel
+
+from app import database
+from app.etl.extractor import CSV_COMPRESSIONS
+from app.etl.loader import ETLStats
+from app.etl.mappings import COLUMN_MAPPINGS, LINE
+from app.etl.profiling import RunProfile, profiled
+from app.models import Car, CarType, Client, Driver, Geoposition, Order, OrderStatus, Payment, Review
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_SIZES = [10000, 100000, 1000000]
+BENCHMARK_FORMATS = ['csv', *CSV_COMPRESSIONS, 'xlsx', 'ods']
+DEFAULT_INVALID_FRACTION = 0.05
+
+# Таблицы в порядке загрузки: родители раньше потомков
+BENCHMARK_TABLES = [CarType, OrderStatus, Car, Client, Driver, Geoposition, Review, Order, Payment]
+
+# CSV файлы таблиц пишутся в разных кодировках и с разными разделителями, как выгрузки из разных систем
+CSV_DIALECTS = [('utf-8', ','), ('cp1251', ';'), ('utf-8-sig', ';')]
+
+# Данные не зависят от даты запуска, чтобы замеры разных дней совпадали
+BASE_TIME = pd.Timestamp('2024-01-01')
+MISSING_KEY = 999999999
+
+NAMES = ['Александр', 'Мария', 'Дмитрий', 'Анна', 'Сергей', 'Елена', 'Андрей', 'Ольга',
+         'Алексей', 'Наталья', 'Иван', 'Татьяна', 'Михаил', 'Екатерина', 'Никита', 'Юлия']
+SURNAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов',
+            'Михайлов', 'Новиков', 'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев']
+CARS = [('Kia', 'Rio'), ('Hyundai', 'Solaris'), ('Skoda', 'Octavia'), ('Volkswagen', 'Polo'),
+        ('Toyota', 'Camry'), ('Renault', 'Logan'), ('Лада', 'Веста'), ('Geely', 'Coolray')]
+COLORS = ['белый', 'черный', 'серый', 'серебристый', 'синий', 'красный', 'желтый']
+PLATE_LETTERS = list('АВЕКМНОРСТУХ')
+CAR_TYPES = ['Эконом', 'Комфорт', 'Комфорт+', 'Бизнес', 'Минивэн', 'Детский', 'Грузовой']
+ORDER_STATUSES = ['Создан', 'Назначен водитель', 'Водитель в пути', 'В поездке', 'Завершен', 'Отменен']
+STREETS = ['ул. Тверская', 'Ленинский пр-т', 'ул. Арбат', 'Кутузовский пр-т', 'ул. Профсоюзная',
+           'Варшавское ш.', 'ул. Маросейка', 'пр-т Мира', 'ул. Новый Арбат', 'Садовая ул.']
+COMMENTS = ['Отличная поездка', 'Водитель вежливый', 'Чистый салон', 'Опоздал на 10 минут',
+            'Громкая музыка', 'Спасибо!', 'Быстро доехали']
+PAYMENT_TYPES = ['Наличные', 'Карта', 'СБП']
+
+# Порча строки: поле и значение, на котором строка должна быть отклонена
+INVALID_VALUES = {
+    CarType: [('name', None)],
+    OrderStatus: [('value', None)],
+    Car: [('year', 'новый'), ('car_type_id', MISSING_KEY)],
+    Client: [('phone', 'не указан'), ('registration_date', 'вчера'), ('email', 'нет почты')],
+    Driver: [('phone', '12-34'), ('registration_date', 'давно'), ('car_id', MISSING_KEY)],
+    Geoposition: [('latitude', 'север'), ('mark_time', 'сейчас'), ('persona_id', MISSING_KEY)],
+    Review: [('rating', 7), ('creation_date', 'на днях'), ('author_id', MISSING_KEY)],
+    Order: [('order_time', 'скоро'), ('passenger_count', 'двое'), ('distance_m', -100),
+            ('client_id', MISSING_KEY)],
+    Payment: [('amount', 'сто рублей'), ('order_id', MISSING_KEY)],
+}
+
+
+class SyntheticData:
+    # Генератор файлов всех таблиц одного размера. Ссылки указывают только на строки
+    # родителей, которые загрузятся: в пустой БД ключи выдаются подряд, испорченные
+    # строки ключ не получают. Персоны клиентов идут первыми, за ними персоны водителей
+    def __init__(self, rows: int, invalid_fraction: float = DEFAULT_INVALID_FRACTION, seed: int = 0):
+        self.rows = rows
+        self.invalid_fraction = invalid_fraction
+        self.seed = seed
+        self.loaded: Dict[Type[SQLModel], int] = {}
+
+    def frame(self, model_class: Type[SQLModel]) -> pd.DataFrame:
+        # Генератор у каждой таблицы свой: данные таблицы не зависят от набора форматов
+        rng = np.random.default_rng([self.seed, self.rows, BENCHMARK_TABLES.index(model_class)])
+        columns = getattr(self, f"_{model_class.__name__.lower()}")(rng)
+        rows = len(next(iter(columns.values())))
+
+        invalid = rng.choice(rows, size=round(rows * self.invalid_fraction), replace=False)
+        kinds = rng.integers(len(INVALID_VALUES[model_class]), size=len(invalid))
+        for kind, (field, value) in enumerate(INVALID_VALUES[model_class]):
+            column = pd.Series(columns[field], dtype=object)
+            column.iloc[invalid[kinds == kind]] = value
+            columns[field] = column
+
+        self.loaded[model_class] = rows - len(invalid)
+        df = pd.DataFrame({name: pd.Series(values, dtype=object) for name, values in columns.items()})
+        df.attrs['invalid_rows'] = len(invalid)
+        return df.rename(columns=file_columns(model_class))
+
+    def _cartype(self, rng) -> Dict[str, Any]:
+        return {'name': _cycle(CAR_TYPES, self.rows)}
+
+    def _orderstatus(self, rng) -> Dict[str, Any]:
+        return {'value': _cycle(ORDER_STATUSES, self.rows)}
+
+    def _car(self, rng) -> Dict[str, Any]:
+        cars = rng.integers(len(CARS), size=self.rows)
+        return {
+            'brand': np.array([brand for brand, _ in CARS], dtype=object)[cars],
+            'model': np.array([model for _, model in CARS], dtype=object)[cars],
+            'license_plate': _plates(rng, self.rows),
+            'color': _choice(rng, COLORS, self.rows),
+            'year': rng.integers(2008, 2024, size=self.rows),
+            'is_personal': _flags(rng, self.rows, 0.3),
+            'car_type_id': self._keys(rng, CarType),
+        }
+
+    def _client(self, rng) -> Dict[str, Any]:
+        return {
+            **self._persona(rng, 79000000000),
+            'surname': _choice(rng, SURNAMES, self.rows),
+            'email': _text('client', self.rows, '@mail.ru'),
+        }
+
+    def _driver(self, rng) -> Dict[str, Any]:
+        return {
+            **self._persona(rng, 79500000000),
+            'surname': _choice(rng, SURNAMES, self.rows),
+            'license_number': _text('77 ', self.rows),
+            'is_working': _flags(rng, self.rows, 0.8),
+            'car_id': self._keys(rng, Car),
+        }
+
+    def _geoposition(self, rng) -> Dict[str, Any]:
+        # У персоны одна геопозиция: строк не больше, чем персон
+        rows = min(self.rows, self.loaded[Client] + self.loaded[Driver])
+        return {
+            'persona_id': np.arange(1, rows + 1),
+            'latitude': np.round(rng.uniform(55.55, 55.95, size=rows), 6),
+            'longitude': np.round(rng.uniform(37.35, 37.85, size=rows), 6),
+            'mark_time': _times(rng, rows, '%d.%m.%Y %H:%M:%S', days=30),
+        }
+
+    def _review(self, rng) -> Dict[str, Any]:
+        # Клиент оценивает водителя, пары (автор, цель) не повторяются
+        clients, drivers = self.loaded[Client], self.loaded[Driver]
+        index = np.arange(self.rows)
+        return {
+            'author_id': index % clients + 1,
+            'target_id': clients + 1 + (index + index // clients) % drivers,
+            'rating': rng.integers(1, 6, size=self.rows),
+            'comment': _optional(rng, _choice(rng, COMMENTS, self.rows), 0.4),
+            'creation_date': _times(rng, self.rows, '%d.%m.%Y %H:%M'),
+        }
+
+    def _order(self, rng) -> Dict[str, Any]:
+        order_time = BASE_TIME - pd.to_timedelta(rng.integers(3600, 365 * 86400, size=self.rows), unit='s')
+        arrival_time = order_time + pd.to_timedelta(rng.integers(180, 1800, size=self.rows), unit='s')
+        return {
+            'order_time': order_time.strftime('%d.%m.%Y %H:%M'),
+            'arrival_time': _optional(rng, arrival_time.strftime('%d.%m.%Y %H:%M'), 0.1),
+            'departure_address': _optional(rng, _addresses(rng, self.rows), 0.2),
+            'destination_address': _addresses(rng, self.rows),
+            'distance_m': np.round(rng.uniform(500, 40000, size=self.rows), 1),
+            'status_id': self._keys(rng, OrderStatus),
+            'driver_id': _optional(rng, self.loaded[Client] + self._keys(rng, Driver), 0.1),
+            'client_id': self._keys(rng, Client),
+            'passenger_count': rng.integers(1, 5, size=self.rows),
+            'has_animals': _flags(rng, self.rows, 0.05),
+            'has_children': _flags(rng, self.rows, 0.1),
+            'has_luggage': _flags(rng, self.rows, 0.3),
+        }
+
+    def _payment(self, rng) -> Dict[str, Any]:
+        # Оплата одна на заказ: строк не больше, чем заказов
+        rows = min(self.rows, self.loaded[Order])
+        amounts = pd.Series(np.round(rng.uniform(150, 5000, size=rows), 2))
+        return {
+            'order_id': np.arange(1, rows + 1),
+            'client_id': rng.integers(1, self.loaded[Client] + 1, size=rows),
+            'amount': amounts.map('{:.2f}'.format).to_numpy(dtype=object),
+            'payment_date': _optional(rng, _times(rng, rows, '%d.%m.%Y %H:%M'), 0.05),
+            'payment_type': _choice(rng, PAYMENT_TYPES, rows),
+        }
+
+    def _persona(self, rng, first_phone: int) -> Dict[str, Any]:
+        return {
+            'name': _choice(rng, NAMES, self.rows),
+            'phone': _text('+', self.rows, start=first_phone),
+            'registration_date': _times(rng, self.rows, '%d.%m.%Y', days=5 * 365),
+            'birthday': _optional(rng, _times(rng, self.rows, '%d.%m.%Y', days=50 * 365,
+                                              offset_days=18 * 365), 0.3),
+        }
+
+    def _keys(self, rng, parent: Type[SQLModel]) -> np.ndarray:
+        return rng.integers(1, self.loaded[parent] + 1, size=self.rows)
+
+
+def file_columns(model_class: Type[SQLModel]) -> Dict[str, str]:
+    # Заголовки файла - первые (русские) имена колонок из COLUMN_MAPPINGS
+    names = {}
+    for file_col, model_field in COLUMN_MAPPINGS[model_class].items():
+        names.setdefault(model_field, file_col)
+    return names
+
+
+def write_file(df: pd.DataFrame, file_path: str, file_format: str,
+               encoding: str = 'utf-8', sep: str = ','):
+    if file_format in ['xlsx', 'ods']:
+        df.to_excel(file_path, index=False, engine='openpyxl' if file_format == 'xlsx' else 'odf')
+    elif file_format == 'csv' or file_format in CSV_COMPRESSIONS:
+        df.to_csv(file_path, index=False, encoding=encoding, sep=sep,
+                  compression=CSV_COMPRESSIONS.get(file_format))
+    else:
+        raise ValueError(f"Неподдерживаемый формат замера: {file_format}. "
+                         f"Доступные: {', '.join(BENCHMARK_FORMATS)}")
+
+
+def _cycle(values: List[str], rows: int) -> np.ndarray:
+    return np.array(values, dtype=object)[np.arange(rows) % len(values)]
+
+
+def _choice(rng, values: List[str], rows: int) -> np.ndarray:
+    return np.array(values, dtype=object)[rng.integers(len(values), size=rows)]
+
+
+def _flags(rng, rows: int, probability: float) -> np.ndarray:
+    return np.where(rng.random(rows) < probability, 'да', 'нет').astype(object)
+
+
+def _optional(rng, values, probability: float) -> np.ndarray:
+    values = np.asarray(values, dtype=object)
+    return np.where(rng.random(len(values)) < probability, None, values)
+
+
+def _text(prefix: str, rows: int, suffix: str = '', start: int = 1) -> np.ndarray:
+    numbers = pd.Series(np.arange(start, start + rows)).astype(str)
+    return (prefix + numbers + suffix).to_numpy(dtype=object)
+
+
+def _times(rng, rows: int, time_format: str, days: int = 365, offset_days: int = 0) -> np.ndarray:
+    seconds = rng.integers(offset_days * 86400 + 3600, (offset_days + days) * 86400, size=rows)
+    return (BASE_TIME - pd.to_timedelta(seconds, unit='s')).strftime(time_format).to_numpy(dtype=object)
+
+
+def _plates(rng, rows: int) -> np.ndarray:
+    letters = np.array(PLATE_LETTERS, dtype=object)
+    plates = (letters[rng.integers(len(letters), size=rows)]
+              + pd.Series(rng.integers(1, 1000, size=rows)).map('{:03d}'.format).to_numpy(dtype=object)
+              + letters[rng.integers(len(letters), size=rows)]
+              + letters[rng.integers(len(letters), size=rows)]
+              + np.array(['77', '97', '99', '177', '197', '799'], dtype=object)[rng.integers(6, size=rows)])
+    return plates
+
+
+def _addresses(rng, rows: int) -> np.ndarray:
+    houses = pd.Series(rng.integers(1, 200, size=rows)).astype(str).to_numpy(dtype=object)
+    return _choice(rng, STREETS, rows) + ', д. ' + houses
+
+
+class BenchmarkReport:
+    def __init__(self, environment: Dict[str, Any]):
+        self.environment = environment
+        self.entries: List[Dict[str, Any]] = []
+
+    def add(self, entry: Dict[str, Any]):
+        self.entries.append(entry)
+
+    def write(self, path: str):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'environment': self.environment, 'results': self.entries},
+                      file, ensure_ascii=False, indent=2, default=str)
+        logger.info(f"Результаты замеров записаны в {path}")
+
+    def compare(self, baseline_path: str) -> str:
+        # Сравнение скорости с замером другого коммита на тех же размерах и форматах
+        with open(baseline_path, encoding='utf-8') as file:
+            baseline = json.load(file)
+        previous = {_entry_key(entry): entry for entry in baseline['results'] if 'error' not in entry}
+
+        lines = [LINE, f"СРАВНЕНИЕ С {baseline['environment'].get('commit') or baseline_path}", LINE]
+        for entry in self.entries:
+            old = previous.get(_entry_key(entry))
+            if old is None or 'error' in entry:
+                continue
+            speed, old_speed = entry['rows_per_second'], old['rows_per_second']
+            change = (speed / old_speed - 1) * 100 if old_speed else 0
+            lines.append(f"{entry['run']['rows']:>8} {entry['run']['format']:8} "
+                         f"{entry['run']['table']:15} {old_speed:10.1f} -> {speed:10.1f} строк/сек "
+                         f"({change:+.1f}%)")
+        lines.append(LINE)
+        return "\n".join(lines) + "\n"
+
+    def __str__(self):
+        lines = [LINE, f"ЗАМЕРЫ ETL (коммит: {self.environment.get('commit') or 'неизвестен'})", LINE]
+        for entry in self.entries:
+            run = entry['run']
+            line = f"{run['rows']:>8} {run['format']:8} {run['table']:15}"
+            if 'error' in entry:
+                lines.append(f"{line} ошибка: {entry['error']}")
+                continue
+            # Без диагностического прогона (--timing-only) обращений к БД и tracemalloc нет
+            database_info = entry['database']
+            traced = entry['memory']['tracemalloc_peak_mb']
+            lines.append(f"{line} {entry['rows_per_second']:10.1f} строк/сек "
+                         f"{entry['duration_seconds']:8.2f} сек  "
+                         f"ошибок: {entry['rows']['errors']:7}  "
+                         f"обращений к БД: {database_info['round_trips'] if database_info else '-':>6}  "
+                         f"tracemalloc: {f'{traced:7.1f} МБ' if traced is not None else '-'}")
+        lines.append(LINE)
+        return "\n".join(lines) + "\n"
+
+
+def _entry_key(entry: Dict[str, Any]):
+    run = entry['run']
+    return run['rows'], run['format'], run['table']
+
+
+def environment(**settings) -> Dict[str, Any]:
+    return {
+        'commit': _git_commit(),
+        'started': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'sqlalchemy': sqlalchemy.__version__,
+        **settings,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    # Замеры сравниваются между коммитами, незакоммиченные изменения помечаются
+    def git(*command: str) -> str:
+        return subprocess.run(['git', *command], cwd=Path(__file__).parent, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    try:
+        commit = git('rev-parse', 'HEAD')
+        dirty = git('status', '--porcelain', '--untracked-files=no')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+
+def run_benchmark(run_import: Callable[[str, str], ETLStats],
+                  sizes: List[int], formats: List[str],
+                  invalid_fraction: float = DEFAULT_INVALID_FRACTION,
+                  seed: int = 0,
+                  work_dir: Optional[str] = None,
+                  timing_only: bool = False,
+                  **settings) -> BenchmarkReport:
+    # Каждый размер и формат загружается в свою пустую БД SQLite во временном каталоге.
+    # Генерация и запись файла в замер не входят
+    report = BenchmarkReport(environment(sizes=sizes, formats=formats, seed=seed,
+                                         invalid_fraction=invalid_fraction,
+                                         timing_only=timing_only, **settings))
+    base = Path(work_dir) if work_dir else Path(tempfile.mkdtemp(prefix='taxi-benchmark-'))
+    base.mkdir(parents=True, exist_ok=True)
+
+    try:
+        for rows in sizes:
+            for file_format in formats:
+                directory = base / f"{rows}_{file_format}"
+                directory.mkdir(exist_ok=True)
+                _run_size(report, run_import, directory, rows, file_format, invalid_fraction, seed,
+                          timing_only)
+    finally:
+        if work_dir is None:
+            shutil.rmtree(base, ignore_errors=True)
+
+    return report
+
+
+def _run_size(report: BenchmarkReport, run_import: Callable[[str, str], ETLStats],
+              directory: Path, rows: int, file_format: str, invalid_fraction: float, seed: int,
+              timing_only: bool = False):
+    data = SyntheticData(rows, invalid_fraction, seed)
+    runs = []
+    for index, model_class in enumerate(BENCHMARK_TABLES):
+        table_name = model_class.__tablename__
+        encoding, sep = CSV_DIALECTS[index % len(CSV_DIALECTS)]
+        if file_format in ['xlsx', 'ods']:
+            encoding = sep = None
+        file_path = directory / f"{table_name}.{file_format}"
+
+        df = data.frame(model_class)
+        write_file(df, str(file_path), file_format, encoding, sep)
+        runs.append((file_path, {
+            'rows': rows,
+            'format': file_format,
+            'table': table_name,
+            'file_rows': len(df),
+            'invalid_rows': df.attrs['invalid_rows'],
+            'encoding': encoding,
+            'sep': sep,
+            'file_mb': file_path.stat().st_size / 1024 ** 2,
+        }))
+        del df
+    del data
+
+    # Время и RSS замеряются без tracemalloc и событий БД: они замедляют импорт.
+    # Память Python и обращения к БД по этапам снимаются отдельным прогоном тех же файлов
+    # в другую БД, его время в отчёт не попадает
+    timed = _run_database(run_import, directory / 'benchmark.db', runs, trace=False)
+    traced = [] if timing_only else _run_database(run_import, directory / 'diagnostics.db', runs, trace=True)
+    traced = {entry['run']['table']: entry for entry in traced}
+
+    for entry in timed:
+        diagnostics = traced.get(entry['run']['table'])
+        if diagnostics is not None and 'error' not in entry and 'error' not in diagnostics:
+            _merge_diagnostics(entry, diagnostics)
+        report.add(entry)
+
+
+def _run_database(run_import: Callable[[str, str], ETLStats], db_path: Path,
+                  runs: List[Tuple[Path, Dict[str, Any]]], trace: bool) -> List[Dict[str, Any]]:
+    db_path.unlink(missing_ok=True)
+    # Тот же путь создания движка, что и у приложения: настройки пула из окружения, другой URL
+    engine = database.make_engine(database.engine_settings()._replace(url=f"sqlite:///{db_path}"))
+    SQLModel.metadata.create_all(engine)
+    previous = database.bind_engine(engine)
+
+    entries = []
+    try:
+        for file_path, run in runs:
+            table_name = run['table']
+            logger.info(f"{'Диагностика' if trace else 'Замер'}: {table_name}, {run['rows']} строк, "
+                        f"формат {run['format']}")
+            gc.collect()
+            profile = RunProfile()
+            try:
+                with profiled(profile, trace_memory=trace, trace_database=trace):
+                    stats = run_import(str(file_path), table_name)
+            except Exception as e:
+                logger.error(f"Замер {table_name} ({run['format']}, {run['rows']} строк) "
+                             f"завершился ошибкой: {e}")
+                entries.append({'run': run, 'error': str(e)})
+                continue
+            entries.append(profile.report(stats, **run))
+    finally:
+        database.bind_engine(previous)
+        engine.dispose()
+
+    return entries
+
+
+def _merge_diagnostics(entry: Dict[str, Any], diagnostics: Dict[str, Any]):
+    # Из диагностического прогона берутся только tracemalloc и обращения к БД
+    entry['memory']['tracemalloc_peak_mb'] = diagnostics['memory']['tracemalloc_peak_mb']
+    entry['memory']['top_allocations'] = diagnostics['memory']['top_allocations']
+    entry['database'] = diagnostics['database']
+    for name, stage in entry['stages'].items():
+        stage['round_trips'] = diagnostics['stages'].get(name, {}).get('round_trips', 0)
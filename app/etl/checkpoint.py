@@ -0,0 +1,70 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from app.etl.extractor import SNIFF_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Файлы от этого размера импортируются с контрольными точками и без --checkpoint
+CHECKPOINT_MIN_BYTES = 100 * 1024 * 1024
+
+
+class Checkpoint:
+    # Состояние прерванного импорта: после каждой закоммиченной пачки файл
+    # перезаписывается целиком через временный файл, чтобы не остаться полузаписанным
+    def __init__(self, file_path: str, table_name: str):
+        path = Path(file_path)
+        self.path = path.with_name(f".{path.name}.{table_name}.checkpoint.json")
+        self.table_name = table_name
+        self.fingerprint = file_fingerprint(file_path)
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        if not self.path.exists():
+            logger.warning(f"Контрольная точка {self.path} не найдена, импорт начнётся с начала")
+            return None
+
+        with open(self.path, encoding='utf-8') as file:
+            state = json.load(file)
+
+        if state.get('fingerprint') != self.fingerprint or state.get('table') != self.table_name:
+            logger.warning(f"Файл изменился после контрольной точки {self.path}, "
+                           f"импорт начнётся с начала")
+            return None
+
+        logger.info(f"Продолжение импорта после строки {state['offset']}")
+        return state
+
+    def save(self, offset: int, stats):
+        state = {
+            'fingerprint': self.fingerprint,
+            'table': self.table_name,
+            'offset': offset,
+            'stats': stats.snapshot(offset),
+        }
+
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(state, file, ensure_ascii=False, default=str)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        if self.path.exists():
+            self.path.unlink()
+
+
+def file_fingerprint(file_path: str) -> Dict[str, Any]:
+    # Размер и хэш начала и конца файла: дёшево и ловит перезапись выгрузки
+    size = os.path.getsize(file_path)
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        digest.update(file.read(SNIFF_BYTES))
+        if size > SNIFF_BYTES:
+            file.seek(max(SNIFF_BYTES, size - SNIFF_BYTES))
+            digest.update(file.read(SNIFF_BYTES))
+    return {'size': size, 'sha256': digest.hexdigest()}
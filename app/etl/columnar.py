@@ -0,0 +1,107 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import pandas as pd
+
+# Parquet и Arrow/Feather читаются пачками записей: в память попадают только нужные
+# колонки и одна порция строк. Индекс порций считается от первой непропущенной строки
+
+
+def parquet_chunks(file_path: str, chunk_size: int,
+                   dtypes: Optional[Dict[str, Any]] = None,
+                   skip_rows: int = 0) -> Iterator[pd.DataFrame]:
+    pa = _pyarrow('parquet')
+    from pyarrow import parquet
+
+    parquet_file = parquet.ParquetFile(file_path)
+    columns = _projection(parquet_file.schema_arrow.names, dtypes)
+
+    # Целиком пропущенные группы строк не читаются с диска
+    row_groups = []
+    for i in range(parquet_file.num_row_groups):
+        num_rows = parquet_file.metadata.row_group(i).num_rows
+        if not row_groups and skip_rows >= num_rows:
+            skip_rows -= num_rows
+            continue
+        row_groups.append(i)
+
+    schema = parquet_file.schema_arrow
+    schema = pa.schema([schema.field(name) for name in columns])
+    batches = parquet_file.iter_batches(batch_size=chunk_size, row_groups=row_groups,
+                                        columns=columns) if row_groups else []
+    yield from _chunks(pa, batches, schema, chunk_size, dtypes, skip_rows)
+
+
+def feather_chunks(file_path: str, chunk_size: int,
+                   dtypes: Optional[Dict[str, Any]] = None,
+                   skip_rows: int = 0) -> Iterator[pd.DataFrame]:
+    pa = _pyarrow('feather')
+    from pyarrow import feather
+
+    try:
+        # Feather v2 - файл Arrow IPC: пачки читаются по одной через отображение в память
+        reader = pa.ipc.open_file(pa.memory_map(file_path))
+    except pa.ArrowInvalid:
+        # Feather v1 пачек не содержит и читается целиком
+        table = feather.read_table(file_path, memory_map=True)
+        table = table.select(_projection(table.schema.names, dtypes))
+        yield from _chunks(pa, table.to_batches(), table.schema, chunk_size, dtypes, skip_rows)
+        return
+
+    columns = _projection(reader.schema.names, dtypes)
+    schema = pa.schema([reader.schema.field(name) for name in columns])
+    batches = (reader.get_batch(i).select(columns) for i in range(reader.num_record_batches))
+    yield from _chunks(pa, batches, schema, chunk_size, dtypes, skip_rows)
+
+
+def _pyarrow(file_format: str):
+    try:
+        import pyarrow
+    except ImportError:
+        raise ValueError(f"Для чтения формата {file_format} нужен пакет pyarrow")
+    return pyarrow
+
+
+def _projection(names: List[str], dtypes: Optional[Dict[str, Any]]) -> List[str]:
+    return [name for name in names if dtypes is None or name in dtypes]
+
+
+def _chunks(pa, batches: Iterable[Any], schema, chunk_size: int,
+            dtypes: Optional[Dict[str, Any]], skip_rows: int) -> Iterator[pd.DataFrame]:
+    # Пачки файла бывают любого размера, порции собираются ровно по chunk_size строк
+    pending = []
+    pending_rows = 0
+    start = 0
+
+    for batch in batches:
+        if skip_rows >= batch.num_rows:
+            skip_rows -= batch.num_rows
+            continue
+        if skip_rows:
+            batch = batch.slice(skip_rows)
+            skip_rows = 0
+
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= chunk_size:
+            table = pa.Table.from_batches(pending, schema=schema)
+            yield _frame(table.slice(0, chunk_size), dtypes, start)
+            start += chunk_size
+            rest = table.slice(chunk_size)
+            pending = rest.to_batches()
+            pending_rows = rest.num_rows
+
+    if pending_rows or start == 0:
+        yield _frame(pa.Table.from_batches(pending, schema=schema), dtypes, start)
+
+
+def _frame(table, dtypes: Optional[Dict[str, Any]], start: int) -> pd.DataFrame:
+    # Целые колонки с пропусками остаются целыми, даты сразу приходят как datetime64
+    df = table.to_pandas(integer_object_nulls=True, date_as_object=False)
+    df.index = range(start, start + len(df))
+    text_columns = [name for name in df.columns if dtypes is not None and dtypes[name] is str]
+    for name in text_columns:
+        column = df[name].astype(object)
+        present = column.notna()
+        column[present] = column[present].astype(str)
+        df[name] = column.where(present, None)
+    return df
@@ -0,0 +1,169 @@
+import bisect
+import csv
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+ERROR_SAMPLE_SIZE = 50
+REJECT_FORMATS = ['.jsonl', '.csv']
+ROW_COLUMN = 'строка_файла'
+ERROR_COLUMN = 'ошибка'
+
+
+def error_category(error: str) -> str:
+    # Категория - сообщение без подробностей конкретной строки:
+    # значения ключа, полученного значения, текста исключения БД
+    message = error.split('; ')[0]
+    if message.startswith("Поле '"):
+        return message.split(' с ключом ')[0]
+    return message.split(':')[0]
+
+
+class ErrorSink:
+    # В памяти - первые sample_size ошибок и счётчики по категориям, все ошибки с данными
+    # строк пишутся в файл отказов. CSV-файл отказов содержит исходные колонки и
+    # загружается обратно после исправления, лишние колонки при импорте отбрасываются
+    def __init__(self, path: Optional[str] = None, sample_size: int = ERROR_SAMPLE_SIZE,
+                 resume_offset: int = 0, track_rows: bool = False):
+        self.path = path
+        self.sample_size = sample_size
+        self.sample: List[Dict[str, Any]] = []
+        self.categories: Counter = Counter()
+        self.track_rows = track_rows
+        self._recent: List[Tuple[int, str]] = []
+        self._lock = threading.Lock()
+        self._file = None
+        self._writer = None
+        self._last_row = 0
+        self._unordered = False
+
+        if path is not None:
+            if Path(path).suffix.lower() not in REJECT_FORMATS:
+                raise ValueError(f"Файл отказов должен иметь расширение {' или '.join(REJECT_FORMATS)}")
+            self._open(resume_offset)
+
+    def samples(self, row_num: int) -> bool:
+        # Образец - ошибки с наименьшими номерами строк: процессы преобразования и потоки
+        # записи присылают ошибки не по порядку строк
+        if len(self.sample) < self.sample_size:
+            return True
+        return bool(self.sample) and row_num < self.sample[-1]['row']
+
+    def needs_data(self, row_num: int) -> bool:
+        return self.path is not None or self.samples(row_num)
+
+    def add(self, row_num: int, error: str, row_data: Optional[Dict[str, Any]] = None):
+        category = error_category(error)
+        with self._lock:
+            self.categories[category] += 1
+            if self.track_rows:
+                self._recent.append((row_num, category))
+            if self.samples(row_num):
+                position = bisect.bisect_right([sample['row'] for sample in self.sample], row_num)
+                self.sample.insert(position, {'row': row_num, 'error': error, 'data': row_data})
+                del self.sample[self.sample_size:]
+            if self._file is not None:
+                self._write(row_num, error, category, row_data)
+                self._unordered |= row_num < self._last_row
+                self._last_row = max(self._last_row, row_num)
+
+    def snapshot(self, offset: int) -> Dict[str, Any]:
+        # Ошибки строк после offset будут найдены заново при продолжении импорта.
+        # _recent хранит только ошибки, ещё не покрытые контрольной точкой
+        with self._lock:
+            later = Counter(category for row_num, category in self._recent if row_num > offset)
+            self._recent = [(row_num, category) for row_num, category in self._recent
+                            if row_num > offset]
+            if self._file is not None:
+                self._file.flush()
+            return {
+                'categories': dict(self.categories - later),
+                'sample': [error for error in self.sample if error['row'] <= offset],
+            }
+
+    def restore(self, snapshot: Dict[str, Any]):
+        self.categories = Counter(snapshot['categories'])
+        self.sample = snapshot['sample']
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            if self._unordered:
+                self._sort()
+            logger.info(f"Ошибки записаны в файл отказов {self.path}")
+
+    def _open(self, resume_offset: int):
+        is_csv = Path(self.path).suffix.lower() == '.csv'
+        if resume_offset and os.path.exists(self.path):
+            # Отказы строк после контрольной точки будут записаны заново
+            self._truncate(resume_offset, is_csv)
+            self._file = open(self.path, 'a', encoding='utf-8', newline='')
+            if is_csv:
+                with open(self.path, encoding='utf-8', newline='') as file:
+                    header = next(csv.reader(file), None)
+                if header is not None:
+                    self._writer = csv.DictWriter(self._file, header, extrasaction='ignore')
+        else:
+            self._file = open(self.path, 'w', encoding='utf-8', newline='')
+
+    def _truncate(self, offset: int, is_csv: bool):
+        temp_path = f"{self.path}.tmp"
+        with open(self.path, encoding='utf-8', newline='') as source, \
+                open(temp_path, 'w', encoding='utf-8', newline='') as target:
+            if is_csv:
+                reader = csv.reader(source)
+                writer = csv.writer(target)
+                header = next(reader, None)
+                if header is not None:
+                    writer.writerow(header)
+                    writer.writerows(row for row in reader if int(row[0]) <= offset)
+            else:
+                target.writelines(line for line in source if json.loads(line)['row'] <= offset)
+        os.replace(temp_path, self.path)
+
+    def _sort(self):
+        # Файл отказов пишется по мере поступления ошибок и упорядочивается по строкам при закрытии
+        is_csv = Path(self.path).suffix.lower() == '.csv'
+        temp_path = f"{self.path}.tmp"
+        with open(self.path, encoding='utf-8', newline='') as source, \
+                open(temp_path, 'w', encoding='utf-8', newline='') as target:
+            if is_csv:
+                reader = csv.reader(source)
+                writer = csv.writer(target)
+                header = next(reader, None)
+                if header is not None:
+                    writer.writerow(header)
+                    writer.writerows(sorted(reader, key=lambda row: int(row[0])))
+            else:
+                target.writelines(sorted(source, key=lambda line: json.loads(line)['row']))
+        os.replace(temp_path, self.path)
+
+    def _write(self, row_num: int, error: str, category: str, row_data: Optional[Dict[str, Any]]):
+        row_data = {name: _value(value) for name, value in (row_data or {}).items()}
+
+        if Path(self.path).suffix.lower() != '.csv':
+            record = {'row': row_num, 'category': category, 'error': error, 'data': row_data}
+            self._file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            return
+
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._file, [ROW_COLUMN, ERROR_COLUMN, *row_data],
+                                          extrasaction='ignore')
+            self._writer.writeheader()
+        self._writer.writerow({ROW_COLUMN: row_num, ERROR_COLUMN: error, **row_data})
+
+
+def _value(value: Any) -> Any:
+    # NaN и pd.NA из исходной порции записываются пустыми значениями
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    return value.item() if hasattr(value, 'item') else value
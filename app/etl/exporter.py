@@ -0,0 +1,236 @@
+import bz2
+import gzip
+import io
+import logging
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Type
+
+from sqlalchemy import Column, inspect, select
+from sqlmodel import SQLModel
+
+from app import database
+from app.etl.extractor import CSV_COMPRESSIONS, detect_format
+from app.etl.mappings import COLUMN_MAPPINGS, LINE
+from app.models import Client, Driver, Geoposition, Order, Payment, Persona, Review
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_ROWS = 10000
+EXPORT_FORMATS = ['csv', *CSV_COMPRESSIONS, 'parquet', 'feather', 'arrow']
+
+# Поле времени, по которому фильтруют выгрузку --since/--until
+TIME_FIELDS = {
+    Client: 'registration_date',
+    Driver: 'registration_date',
+    Geoposition: 'mark_time',
+    Review: 'creation_date',
+    Order: 'order_time',
+    Payment: 'payment_date',
+}
+
+
+class ExportStats:
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.row_count = 0
+        self.batch_count = 0
+        self.start_time = datetime.now()
+        self.end_time = None
+
+    def add_batch(self, rows: int):
+        self.row_count += rows
+        self.batch_count += 1
+
+    def finish(self):
+        self.end_time = datetime.now()
+
+    def get_duration(self) -> float:
+        if self.end_time:
+            return (self.end_time - self.start_time).total_seconds()
+        return 0
+
+    def get_rows_per_second(self) -> float:
+        duration = self.get_duration()
+        return self.row_count / duration if duration > 0 else 0
+
+    def __str__(self):
+        return (
+            f"{LINE}\n"
+            f"ВЫГРУЗКА\n"
+            f"{LINE}\n"
+            f"Файл: {self.output_path}\n"
+            f"Выгружено строк: {self.row_count}\n"
+            f"Пачек: {self.batch_count}\n"
+            f"Время выполнения: {self.get_duration():.2f} сек\n"
+            f"Скорость выгрузки: {self.get_rows_per_second():.1f} строк/сек\n"
+            f"{LINE}\n"
+        )
+
+
+def export_columns(model_class: Type[SQLModel]) -> Dict[str, Column]:
+    # Колонки файла называются так же, как при импорте: первое имя из COLUMN_MAPPINGS,
+    # поля без сопоставления - по имени колонки БД. Клиент и водитель выгружаются с персоной
+    models = [model_class]
+    if model_class is Client or model_class is Driver:
+        models.insert(0, Persona)
+
+    file_names = {}
+    for file_col, model_field in COLUMN_MAPPINGS.get(model_class, {}).items():
+        file_names.setdefault(model_field, file_col)
+
+    columns = {}
+    for model in models:
+        for attr in inspect(model).column_attrs:
+            if model is not model_class and attr.key == 'id':
+                continue
+            column = attr.columns[0]
+            columns[file_names.get(attr.key, column.key)] = column
+    return columns
+
+
+def export_query(model_class: Type[SQLModel], columns: Dict[str, Column],
+                 since: Optional[datetime] = None, until: Optional[datetime] = None,
+                 statuses: Optional[Sequence[int]] = None):
+    query = select(*[column.label(name) for name, column in columns.items()])
+    if model_class is Client or model_class is Driver:
+        query = query.join_from(model_class, Persona, model_class.id == Persona.id)
+
+    # Фильтры выполняются в БД, чтобы не тянуть лишние строки
+    if since is not None or until is not None:
+        time_field = TIME_FIELDS.get(model_class)
+        if time_field is None:
+            raise ValueError(f"Таблицу {model_class.__tablename__} нельзя фильтровать по времени")
+        time_column = getattr(Persona if time_field == 'registration_date' else model_class, time_field)
+        if since is not None:
+            query = query.where(time_column >= since)
+        if until is not None:
+            query = query.where(time_column < until)
+
+    if statuses:
+        if model_class is not Order:
+            raise ValueError("Фильтр по статусу есть только у заказов")
+        query = query.where(Order.status_id.in_(statuses))
+
+    return query
+
+
+def export_table(model_class: Type[SQLModel], output_path: str,
+                 file_format: Optional[str] = None,
+                 batch_size: int = EXPORT_BATCH_ROWS,
+                 since: Optional[datetime] = None,
+                 until: Optional[datetime] = None,
+                 statuses: Optional[Sequence[int]] = None) -> ExportStats:
+    file_format = file_format or detect_format(output_path)
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Неподдерживаемый формат выгрузки: {file_format}. "
+                         f"Доступные: {', '.join(EXPORT_FORMATS)}")
+
+    columns = export_columns(model_class)
+    query = export_query(model_class, columns, since, until, statuses)
+    stats = ExportStats(output_path)
+
+    logger.info(f"Выгрузка таблицы {model_class.__tablename__} в {output_path} "
+                f"(формат: {file_format}, размер пачки: {batch_size})")
+
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ValueError("Для выгрузки нужен пакет pyarrow")
+
+    schema = pa.schema([(name, _arrow_type(pa, column)) for name, column in columns.items()])
+    writer = _writer(pa, output_path, file_format, schema)
+
+    try:
+        # yield_per включает серверный курсор: в памяти одна пачка строк
+        with database.get_engine().connect() as connection:
+            result = connection.execution_options(yield_per=batch_size).execute(query)
+            for rows in result.partitions():
+                arrays = [pa.array(values, type=field.type)
+                          for values, field in zip(zip(*rows), schema)]
+                writer.write(pa.RecordBatch.from_arrays(arrays, schema=schema))
+                stats.add_batch(len(rows))
+                logger.info(f"Выгружено строк: {stats.row_count}")
+    except BaseException:
+        # Недописанный файл не оставляем, чтобы его не приняли за полную выгрузку
+        writer.close()
+        Path(output_path).unlink(missing_ok=True)
+        raise
+    writer.close()
+
+    stats.finish()
+    return stats
+
+
+def _arrow_type(pa, column: Column):
+    python_type = column.type.python_type
+    if python_type is bool:
+        return pa.bool_()
+    if python_type is int:
+        return pa.int64()
+    if python_type is float:
+        return pa.float64()
+    if python_type is Decimal:
+        # MONEY: 19 знаков, 4 после запятой
+        return pa.decimal128(column.type.precision or 19, column.type.scale or 4)
+    if python_type is datetime:
+        return pa.timestamp('us')
+    return pa.string()
+
+
+def _writer(pa, output_path: str, file_format: str, schema):
+    if file_format == 'parquet':
+        from pyarrow import parquet
+        return _BatchWriter(parquet.ParquetWriter(output_path, schema))
+    if file_format in ['feather', 'arrow']:
+        return _BatchWriter(pa.ipc.new_file(output_path, schema))
+    return _CsvWriter(_open_text(output_path, CSV_COMPRESSIONS.get(file_format)), schema)
+
+
+class _BatchWriter:
+    # Каждая пачка - отдельная группа строк Parquet или пачка записей Arrow
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, batch):
+        self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+
+
+class _CsvWriter:
+    # Заголовок пишется один раз, пачки дописываются в тот же поток
+    def __init__(self, file, schema):
+        self.file = file
+        self.schema = schema
+        self.header = True
+
+    def write(self, batch):
+        df = batch.to_pandas(integer_object_nulls=True)
+        df.to_csv(self.file, header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.header:
+            # Пустая выгрузка - только заголовок
+            self.write(self.schema.empty_table())
+        self.file.close()
+
+
+def _open_text(output_path: str, compression: Optional[str]):
+    if compression == 'gzip':
+        return gzip.open(output_path, 'wt', encoding='utf-8', newline='')
+    if compression == 'bz2':
+        return bz2.open(output_path, 'wt', encoding='utf-8', newline='')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("Для записи .zst нужен пакет zstandard")
+        stream = zstandard.ZstdCompressor().stream_writer(open(output_path, 'wb'), closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    return open(output_path, 'w', encoding='utf-8', newline='')
@@ -1,57 +1,256 @@
+import bz2
+import codecs
+import csv
+import gzip
 import logging
 from pathlib import Path
+from typing import Any, Dict, Iterator, NamedTuple, Optional
 
 import pandas as pd
 
+from app.etl.columnar import feather_chunks, parquet_chunks
+from app.etl.file_cache import cached_chunks, cached_frame
+from app.etl.profiling import stage
+from app.etl.spreadsheets import frame_chunks, iter_ods_rows, iter_xlsx_rows
+
 logger = logging.getLogger(__name__)
 
+SNIFF_BYTES = 64 * 1024
+SHEET_CHUNK_ROWS = 100000
 
-def read_file(file_path: str, file_format: str = None) -> pd.DataFrame:
-    path = Path(file_path)
+_boms = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+_encodings = ['utf-8', 'cp1251', 'latin1']
+_separators = [',', ';', '\t']
 
-    if not path.exists():
-        raise FileNotFoundError(f"Файл не найден: {file_path}")
+# Сжатые CSV распаковываются на лету, формат задаётся двойным расширением: cars.csv.gz
+CSV_COMPRESSIONS = {'csv.gz': 'gzip', 'csv.bz2': 'bz2', 'csv.zst': 'zstd'}
+FILE_FORMATS = ['csv', *CSV_COMPRESSIONS, 'xlsx', 'xls', 'ods', 'odt', 'parquet', 'feather', 'arrow']
 
-    if file_format is None:
-        file_format = path.suffix.lower().lstrip('.')
+
+class CsvDialect(NamedTuple):
+    encoding: str
+    sep: str
+
+    def __str__(self):
+        return f"encoding={self.encoding}, sep={self.sep!r}"
+
+
+# dtypes задаёт и типы, и проекцию: читаются только перечисленные в нём колонки.
+# skip_rows пропускает первые строки данных, индекс при этом сохраняет номера строк файла
+def read_file(file_path: str, file_format: str = None,
+              dtypes: Optional[Dict[str, Any]] = None,
+              skip_rows: int = 0,
+              use_cache: bool = True) -> pd.DataFrame:
+    file_format = _resolve_format(file_path, file_format)
 
     logger.info(f"Чтение файла {file_path} (формат: {file_format})")
 
-    if file_format == 'csv':
-        return _read_csv(file_path)
-    elif file_format in ['xlsx', 'xls']:
-        return _read_excel(file_path, file_format)
+    # Таблицы разбираются медленно, поэтому результат кэшируется
+    options = {'format': file_format, 'dtypes': dtypes, 'skip_rows': skip_rows}
+
+    if file_format == 'csv' or file_format in CSV_COMPRESSIONS:
+        df = _read_csv(file_path, dtypes, skip_rows, CSV_COMPRESSIONS.get(file_format))
+    elif file_format == 'parquet':
+        df = _read_columnar(parquet_chunks(file_path, SHEET_CHUNK_ROWS, dtypes, skip_rows))
+    elif file_format in ['feather', 'arrow']:
+        df = _read_columnar(feather_chunks(file_path, SHEET_CHUNK_ROWS, dtypes, skip_rows))
+    elif file_format == 'xlsx':
+        df = cached_frame(file_path, options, use_cache,
+                          lambda: _read_sheet(iter_xlsx_rows(file_path), dtypes, skip_rows))
+    elif file_format == 'xls':
+        df = cached_frame(file_path, options, use_cache,
+                          lambda: _read_excel(file_path, file_format, dtypes, skip_rows))
     elif file_format in ['ods', 'odt']:
-        return _read_ods(file_path)
+        df = cached_frame(file_path, options, use_cache,
+                          lambda: _read_sheet(iter_ods_rows(file_path), dtypes, skip_rows))
     else:
         raise ValueError(f"Неподдерживаемый формат файла: {file_format}")
 
+    df.index += skip_rows
+    return df
+
+
+def read_file_chunks(file_path: str, file_format: str = None,
+                     chunk_size: int = 10000,
+                     dtypes: Optional[Dict[str, Any]] = None,
+                     skip_rows: int = 0,
+                     use_cache: bool = True) -> Iterator[pd.DataFrame]:
+    file_format = _resolve_format(file_path, file_format)
+
+    logger.info(f"Потоковое чтение файла {file_path} (формат: {file_format}, "
+                f"размер порции: {chunk_size})")
 
-def _read_csv(file_path: str) -> pd.DataFrame:
-    encodings = ['utf-8', 'cp1251', 'latin1']
-    separators = [',', ';', '\t']
+    if file_format == 'csv' or file_format in CSV_COMPRESSIONS:
+        yield from _read_csv_chunks(file_path, chunk_size, dtypes, skip_rows,
+                                    CSV_COMPRESSIONS.get(file_format))
+        return
+
+    # xlsx и ods читаются построчно, parquet и feather - пачками записей:
+    # память не зависит от размера файла. Разобранные листы кэшируются в Parquet
+    options = {'format': file_format, 'dtypes': dtypes, 'stream': True}
+    if file_format == 'xlsx':
+        chunks = cached_chunks(file_path, options, use_cache,
+                               lambda skip: frame_chunks(iter_xlsx_rows(file_path), chunk_size, dtypes, skip),
+                               chunk_size, dtypes, skip_rows)
+    elif file_format in ['ods', 'odt']:
+        chunks = cached_chunks(file_path, options, use_cache,
+                               lambda skip: frame_chunks(iter_ods_rows(file_path), chunk_size, dtypes, skip),
+                               chunk_size, dtypes, skip_rows)
+    elif file_format == 'parquet':
+        chunks = parquet_chunks(file_path, chunk_size, dtypes, skip_rows)
+    elif file_format in ['feather', 'arrow']:
+        chunks = feather_chunks(file_path, chunk_size, dtypes, skip_rows)
+    else:
+        chunks = None
+
+    if chunks is not None:
+        for chunk in chunks:
+            chunk.index += skip_rows
+            yield chunk
+        return
+
+    df = read_file(file_path, file_format, dtypes, skip_rows, use_cache)
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size]
+
+
+def _resolve_format(file_path: str, file_format: str = None) -> str:
+    path = Path(file_path)
+
+    if not path.exists():
+        raise FileNotFoundError(f"Файл не найден: {file_path}")
+
+    if file_format is None:
+        file_format = detect_format(file_path)
 
-    for encoding in encodings:
-        for sep in separators:
-            try:
-                df = pd.read_csv(file_path, encoding=encoding, sep=sep)
-                if len(df.columns) > 1:
-                    logger.info(f"CSV прочитан (encoding={encoding}, sep='{sep}')")
-                    return df
-            except Exception:
-                continue
+    return file_format
 
-    raise ValueError("Не удалось определить формат CSV файла")
 
+def detect_format(file_path: str) -> str:
+    suffixes = ''.join(Path(file_path).suffixes[-2:]).lower().lstrip('.')
+    if suffixes in CSV_COMPRESSIONS:
+        return suffixes
+    return Path(file_path).suffix.lower().lstrip('.')
 
-def _read_excel(file_path: str, file_format: str) -> pd.DataFrame:
+
+def sniff_csv(file_path: str, compression: Optional[str] = None) -> CsvDialect:
+    with stage('sniff'):
+        # Для сжатого файла образец берётся из распакованного потока
+        with _open_csv(file_path, compression) as file:
+            sample = file.read(SNIFF_BYTES)
+
+        encoding, text = _detect_encoding(sample)
+
+        try:
+            sep = csv.Sniffer().sniff(text, delimiters=''.join(_separators)).delimiter
+        except csv.Error:
+            # Sniffer не справляется, например, с одной колонкой: смотрим на заголовок
+            header = text.splitlines()[0] if text else ''
+            sep = max(_separators, key=header.count)
+
+    dialect = CsvDialect(encoding, sep)
+    logger.info(f"Формат CSV определён: {dialect}")
+    return dialect
+
+
+def _open_csv(file_path: str, compression: Optional[str]):
+    if compression == 'gzip':
+        return gzip.open(file_path, 'rb')
+    if compression == 'bz2':
+        return bz2.open(file_path, 'rb')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("Для чтения .zst нужен пакет zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), closefd=True)
+    return open(file_path, 'rb')
+
+
+def _detect_encoding(sample: bytes):
+    for bom, encoding in _boms:
+        if sample.startswith(bom):
+            return encoding, sample.decode(encoding, errors='ignore')
+
+    for encoding in _encodings:
+        try:
+            # Образец может обрываться посреди многобайтового символа
+            text = codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding, text
+        except UnicodeDecodeError:
+            continue
+
+    raise ValueError("Не удалось определить кодировку CSV файла")
+
+
+def _read_csv(file_path: str, dtypes: Optional[Dict[str, Any]] = None,
+              skip_rows: int = 0, compression: Optional[str] = None) -> pd.DataFrame:
+    dialect = sniff_csv(file_path, compression)
+    df = pd.read_csv(file_path, skiprows=_skipped(skip_rows), **_csv_options(dialect, dtypes, compression))
+    df.attrs['dialect'] = str(dialect)
+    return df
+
+
+def _read_csv_chunks(file_path: str, chunk_size: int,
+                     dtypes: Optional[Dict[str, Any]] = None,
+                     skip_rows: int = 0,
+                     compression: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    dialect = sniff_csv(file_path, compression)
+    with pd.read_csv(file_path, chunksize=chunk_size, skiprows=_skipped(skip_rows),
+                     **_csv_options(dialect, dtypes, compression)) as reader:
+        for chunk in reader:
+            chunk.index += skip_rows
+            chunk.attrs['dialect'] = str(dialect)
+            yield chunk
+
+
+def _skipped(skip_rows: int) -> Optional[range]:
+    # Строка 0 - заголовок, его не пропускаем. Пропущенные строки парсер не разбирает в значения
+    return range(1, skip_rows + 1) if skip_rows else None
+
+
+def _csv_options(dialect: CsvDialect, dtypes: Optional[Dict[str, Any]],
+                 compression: Optional[str] = None) -> Dict[str, Any]:
+    options = {'encoding': dialect.encoding, 'sep': dialect.sep, 'compression': compression}
+    if dtypes is not None:
+        options['usecols'] = lambda column: column in dtypes
+        options['dtype'] = dtypes
+    return options
+
+
+def _excel_options(dtypes: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if dtypes is None:
+        return {}
+    # Ячейки таблиц уже типизированы, принудительно задаются только текстовые колонки
+    return {
+        'usecols': lambda column: column in dtypes,
+        'dtype': {column: dtype for column, dtype in dtypes.items() if dtype is str},
+    }
+
+
+def _read_excel(file_path: str, file_format: str,
+                dtypes: Optional[Dict[str, Any]] = None,
+                skip_rows: int = 0) -> pd.DataFrame:
     engine = 'openpyxl' if file_format == 'xlsx' else 'xlrd'
-    df = pd.read_excel(file_path, engine=engine)
+    df = pd.read_excel(file_path, engine=engine, skiprows=_skipped(skip_rows),
+                       **_excel_options(dtypes))
     logger.info(f"Excel файл прочитан")
     return df
 
 
-def _read_ods(file_path: str) -> pd.DataFrame:
-    df = pd.read_excel(file_path, engine='odf')
-    logger.info(f"ODS/ODT файл прочитан")
+def _read_sheet(rows: Iterator[Any], dtypes: Optional[Dict[str, Any]] = None,
+                skip_rows: int = 0) -> pd.DataFrame:
+    chunks = list(frame_chunks(rows, SHEET_CHUNK_ROWS, dtypes, skip_rows))
+    df = pd.concat(chunks) if chunks else pd.DataFrame()
+    logger.info(f"Таблица прочитана")
+    return df
+
+
+def _read_columnar(chunks: Iterator[pd.DataFrame]) -> pd.DataFrame:
+    df = pd.concat(list(chunks))
+    logger.info(f"Колоночный файл прочитан")
     return df
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import pandas as pd
+
+from app.etl.columnar import parquet_chunks
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path.home() / '.cache' / 'taksi_etl'
+CACHE_MAX_BYTES = 1024 ** 3
+HASH_BLOCK = 1024 * 1024
+
+_lock = threading.Lock()
+
+
+def cached_frame(file_path: str, options: Dict[str, Any], enabled: bool,
+                 read: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+    # Разобранный лист хранится в Parquet: ключ - хэш содержимого файла и параметры чтения
+    if not enabled:
+        return read()
+
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        logger.warning("pyarrow не установлен, кэш разобранных файлов отключён")
+        return read()
+
+    cache_path = CACHE_DIR / f"{_cache_key(file_path, options)}.parquet"
+
+    if cache_path.exists():
+        try:
+            df = pd.read_parquet(cache_path)
+            os.utime(cache_path)
+            logger.info(f"Файл {file_path} прочитан из кэша {cache_path}")
+            return df
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать кэш {cache_path}: {e}")
+
+    df = read()
+    _store(cache_path, df)
+    return df
+
+
+def cached_chunks(file_path: str, options: Dict[str, Any], enabled: bool,
+                  read: Callable[[int], Iterator[pd.DataFrame]], chunk_size: int,
+                  dtypes: Optional[Dict[str, Any]] = None,
+                  skip_rows: int = 0) -> Iterator[pd.DataFrame]:
+    # Потоковое чтение: лист целиком дописывается в Parquet по мере разбора порций,
+    # повторное чтение идёт пачками записей из кэша, пропущенные строки не разбираются
+    if not enabled:
+        yield from read(skip_rows)
+        return
+
+    try:
+        from pyarrow import parquet
+    except ImportError:
+        logger.warning("pyarrow не установлен, кэш разобранных файлов отключён")
+        yield from read(skip_rows)
+        return
+
+    cache_path = CACHE_DIR / f"{_cache_key(file_path, options)}.parquet"
+
+    if cache_path.exists():
+        try:
+            parquet.ParquetFile(cache_path)
+            os.utime(cache_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать кэш {cache_path}: {e}")
+        else:
+            logger.info(f"Файл {file_path} читается из кэша {cache_path}")
+            yield from parquet_chunks(str(cache_path), chunk_size, dtypes, skip_rows)
+            return
+
+    if skip_rows:
+        # Продолжение импорта: начало листа не разбирается, а кэш хранит лист целиком
+        yield from read(skip_rows)
+        return
+
+    yield from _store_chunks(cache_path, read(0), dtypes)
+
+
+def _cache_key(file_path: str, options: Dict[str, Any]) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK), b''):
+            digest.update(block)
+    digest.update(json.dumps(options, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _store(cache_path: Path, df: pd.DataFrame):
+    temp_path = cache_path.with_name(f"{cache_path.name}.{threading.get_ident()}.tmp")
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(temp_path)
+        os.replace(temp_path, cache_path)
+    except Exception as e:
+        # Например, колонка с числами и строками вперемешку не ложится в Parquet
+        logger.warning(f"Результат не сохранён в кэш: {e}")
+        if temp_path.exists():
+            temp_path.unlink()
+        return
+
+    _evict()
+
+
+def _store_chunks(cache_path: Path, chunks: Iterator[pd.DataFrame],
+                  dtypes: Optional[Dict[str, Any]]) -> Iterator[pd.DataFrame]:
+    # Порции отдаются сразу, кэш появляется, только если лист дочитан до конца
+    import pyarrow as pa
+    from pyarrow import parquet
+
+    temp_path = cache_path.with_name(f"{cache_path.name}.{threading.get_ident()}.tmp")
+    writer = None
+    failed = False
+    try:
+        for chunk in chunks:
+            if not failed:
+                try:
+                    if writer is None:
+                        table = pa.Table.from_pandas(chunk, preserve_index=False)
+                        table = table.cast(_text_schema(pa, table.schema, dtypes))
+                        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                        writer = parquet.ParquetWriter(temp_path, table.schema)
+                    else:
+                        table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+                    writer.write_table(table)
+                except (pa.ArrowException, TypeError, ValueError) as e:
+                    # Например, колонка с числами и строками вперемешку не ложится в Parquet
+                    logger.warning(f"Результат не сохранён в кэш: {e}")
+                    failed = True
+            yield chunk
+
+        if writer is not None and not failed:
+            writer.close()
+            writer = None
+            os.replace(temp_path, cache_path)
+            _evict()
+    finally:
+        if writer is not None:
+            writer.close()
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def _text_schema(pa, schema, dtypes: Optional[Dict[str, Any]]):
+    # Текстовая колонка из одних пропусков в первой порции получила бы тип null
+    return pa.schema([
+        field.with_type(pa.string())
+        if pa.types.is_null(field.type) or (dtypes is not None and dtypes.get(field.name) is str)
+        else field
+        for field in schema
+    ])
+
+
+def _evict():
+    # Вытесняются давно не использованные файлы, пока кэш не уложится в CACHE_MAX_BYTES
+    with _lock:
+        entries = []
+        for path in CACHE_DIR.glob('*.parquet'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= CACHE_MAX_BYTES:
+                break
+            try:
+                path.unlink()
+                total -= size
+                logger.info(f"Из кэша удалён {path.name}")
+            except OSError:
+                continue
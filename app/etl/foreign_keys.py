@@ -0,0 +1,96 @@
+import logging
+import threading
+from typing import Dict, Iterable, List, Tuple, Type
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Column, select
+from sqlmodel import SQLModel
+
+from app.database import session_scope
+from app.models import Client, Driver
+
+logger = logging.getLogger(__name__)
+
+
+class KeySet:
+    # Ключи из БД хранятся отсортированным массивом int64, новые ключи прогона
+    # копятся отдельно и вливаются в массив при следующей проверке
+    def __init__(self, keys: np.ndarray):
+        self._keys = np.unique(keys.astype(np.int64))
+        self._added: List[int] = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._keys) + len(self._added)
+
+    def add(self, keys: Iterable[int]):
+        with self._lock:
+            self._added.extend(keys)
+
+    def contains(self, values: pd.Series) -> pd.Series:
+        with self._lock:
+            if self._added:
+                self._keys = np.union1d(self._keys, np.array(self._added, dtype=np.int64))
+                self._added = []
+            keys = self._keys
+        return pd.Series(np.isin(values.to_numpy(), keys), index=values.index)
+
+
+class ForeignKeyCache:
+    def __init__(self):
+        self._sets: Dict[str, KeySet] = {}
+        self._lock = threading.Lock()
+
+    def check(self, model_class: Type[SQLModel], data: pd.DataFrame) -> pd.Series:
+        errors = pd.Series(None, index=data.index, dtype=object)
+
+        for field, column in _references(model_class):
+            if field not in data.columns:
+                continue
+
+            present = data[field].notna()
+            values = pd.to_numeric(data[field].where(present), errors='coerce')
+            missing = present & ~self._key_set(column).contains(values.fillna(-1))
+
+            if missing.any():
+                message = (f"Поле '{field}': нет записи в таблице {column.table.name} с ключом "
+                           + data.loc[missing, field].astype(str))
+                errors = errors.mask(missing & errors.isna(), message)
+
+        return errors
+
+    def register(self, model_class: Type[SQLModel], keys: Iterable[int]):
+        key_set = self._sets.get(model_class.__tablename__)
+        if key_set is not None:
+            key_set.add(keys)
+
+    def tracks(self, model_class: Type[SQLModel]) -> bool:
+        return model_class.__tablename__ in self._sets
+
+    def _key_set(self, column: Column) -> KeySet:
+        table_name = column.table.name
+        with self._lock:
+            if table_name not in self._sets:
+                self._sets[table_name] = KeySet(_fetch_keys(column))
+                logger.info(f"Загружено {len(self._sets[table_name])} ключей таблицы {table_name} "
+                            f"для проверки внешних ключей")
+            return self._sets[table_name]
+
+
+def _references(model_class: Type[SQLModel]) -> List[Tuple[str, Column]]:
+    references = []
+    for foreign_key in model_class.__table__.foreign_keys:
+        if foreign_key.parent.primary_key and (model_class is Client or model_class is Driver):
+            # id клиента/водителя берётся из только что созданной персоны
+            continue
+        field = model_class.__mapper__.get_property_by_column(foreign_key.parent).key
+        references.append((field, foreign_key.column))
+    return references
+
+
+def _fetch_keys(column: Column) -> np.ndarray:
+    with session_scope() as session:
+        keys = session.execute(select(column)).scalars()
+        return np.fromiter(keys, dtype=np.int64)
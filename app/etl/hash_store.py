@@ -0,0 +1,139 @@
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple, Type
+
+import numpy as np
+import pandas as pd
+from sqlmodel import SQLModel
+
+from app.database import get_engine, session_scope
+from app.etl.upsert import existing_keys
+
+logger = logging.getLogger(__name__)
+
+HASH_STORE_NAME = '.etl_hashes.sqlite'
+
+_key_separator = '\x1f'
+
+
+def default_hash_store_path(file_path: str) -> str:
+    # Хранилище лежит рядом с файлом: партнёр присылает выгрузки в один и тот же каталог
+    return str(Path(file_path).with_name(HASH_STORE_NAME))
+
+
+def database_identity() -> str:
+    # Сервер и база без учётных данных и драйвера: хэши одной БД не действуют для другой
+    url = get_engine().url
+    server = f"{url.host or ''}:{url.port}" if url.port else (url.host or '')
+    return f"{url.get_backend_name()}://{server}/{url.database or ''}"
+
+
+class HashStore:
+    # Естественный ключ строки -> хэш её содержимого после преобразования, отдельно для
+    # каждой БД. Хэши попадают в хранилище только после коммита строк в БД
+    def __init__(self, path: str, model_class: Type[SQLModel], key_fields: Sequence[str]):
+        self.path = path
+        self.model_class = model_class
+        self.table_name = model_class.__tablename__
+        self.key_fields = list(key_fields)
+        self.target = database_identity()
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Tuple[str, int]] = {}
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._create_table()
+        self._hashes = self._load()
+
+        logger.info(f"Хранилище хэшей {path}: {len(self._hashes)} строк таблицы {self.table_name} "
+                    f"для {self.target}")
+
+    def changed_rows(self, data: pd.DataFrame) -> pd.Series:
+        # Отмечает новые и изменённые строки и запоминает их хэши до коммита
+        keys = _row_keys(data, self.key_fields)
+        hashes = _row_hashes(data)
+        stored = self._hashes.reindex(keys.dropna())
+
+        unchanged = pd.Series(False, index=data.index)
+        unchanged[keys.notna()] = (stored.to_numpy() == hashes[keys.notna()].to_numpy())
+        if unchanged.any():
+            # Хэш действителен, только пока строка есть в БД: её могли удалить или пересоздать базу
+            exists = self._exists(data[unchanged])
+            if not exists.all():
+                logger.info(f"Строк с прежним хэшем нет в БД, будут загружены: {int((~exists).sum())}")
+            unchanged[unchanged] = exists.to_numpy()
+
+        changed = ~unchanged
+        tracked = changed & keys.notna()
+        with self._lock:
+            for idx, key, row_hash in zip(data.index[tracked], keys[tracked], hashes[tracked]):
+                self._pending[idx + 1] = (key, int(row_hash))
+
+        return changed
+
+    def commit(self, row_nums: List[int], committed: List[int]):
+        # Новые и обновлённые строки считает upsert по ответу БД, здесь только сохраняются хэши
+        committed = set(committed)
+        records = []
+
+        with self._lock:
+            for row_num in row_nums:
+                pending = self._pending.pop(row_num, None)
+                if row_num in committed and pending is not None:
+                    key, row_hash = pending
+                    records.append((self.target, self.table_name, key, row_hash))
+
+            if records:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO row_hashes (target, table_name, row_key, row_hash) "
+                    "VALUES (?, ?, ?, ?)",
+                    records
+                )
+                self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+    def _create_table(self):
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(row_hashes)")]
+        if columns and 'target' not in columns:
+            # Хэши прежнего формата не привязаны к БД, доверять им нельзя
+            logger.warning(f"Хранилище хэшей {self.path} без привязки к БД сброшено")
+            self._connection.execute("DROP TABLE row_hashes")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS row_hashes ("
+            "target TEXT NOT NULL, table_name TEXT NOT NULL, row_key TEXT NOT NULL, "
+            "row_hash INTEGER NOT NULL, PRIMARY KEY (target, table_name, row_key)) WITHOUT ROWID"
+        )
+        self._connection.commit()
+
+    def _exists(self, data: pd.DataFrame) -> pd.Series:
+        keys = list(data[self.key_fields].itertuples(index=False, name=None))
+        with session_scope() as session:
+            found = existing_keys(session, self.model_class, keys, self.key_fields)
+        return pd.Series([key in found for key in keys], index=data.index, dtype=bool)
+
+    def _load(self) -> pd.Series:
+        rows = self._connection.execute(
+            "SELECT row_key, row_hash FROM row_hashes WHERE target = ? AND table_name = ?",
+            (self.target, self.table_name)
+        ).fetchall()
+        if not rows:
+            return pd.Series([], index=pd.Index([], dtype=object), dtype=np.int64)
+        keys, hashes = zip(*rows)
+        return pd.Series(np.array(hashes, dtype=np.int64), index=pd.Index(keys, dtype=object))
+
+
+def _row_keys(data: pd.DataFrame, key_fields: List[str]) -> pd.Series:
+    present = data[key_fields].notna().all(axis=1)
+    keys = data[key_fields[0]].astype(str)
+    for field in key_fields[1:]:
+        keys = keys.str.cat(data[field].astype(str), sep=_key_separator)
+    return keys.where(present, None)
+
+
+def _row_hashes(data: pd.DataFrame) -> pd.Series:
+    # hash_pandas_object детерминирован между запусками; uint64 хранится в INTEGER как int64
+    hashes = pd.util.hash_pandas_object(data[sorted(data.columns)], index=False)
+    return pd.Series(hashes.to_numpy().view(np.int64), index=data.index)
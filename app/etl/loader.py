@@ -1,39 +1,112 @@
 import logging
 from datetime import datetime
-from typing import Type, Dict, List, Any
+from typing import Type, Dict, List, Any, Tuple, Iterator, Optional
 
 import pandas as pd
+from sqlalchemy import insert
 from sqlalchemy.exc import IntegrityError
 from sqlmodel import SQLModel
 
-from app.database import session_scope, create_entity_s
-from app.etl.transformer import transform_row, validate_entity
+from app.database import session_scope
+from app.etl.checkpoint import Checkpoint
+from app.etl.error_sink import ErrorSink
+from app.etl.foreign_keys import ForeignKeyCache
+from app.etl.hash_store import HashStore
+from app.etl.personas import PERSONA_ID, PersonaIndex
+from app.etl.profiling import stage
+from app.etl.upsert import match_returned_keys, upsert_batch
+from app.etl.transformer import TransformResult, combine_errors, prepare_frame
 from app.models import Client, Driver, Persona
-from app.etl.mappings import LINE
+from app.etl.mappings import LINE, field_types
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_BATCH_SIZE = 1000
+
 
 class ETLStats:
-    def __init__(self):
+    def __init__(self, error_sink: Optional[ErrorSink] = None):
         self.total_rows = 0
         self.success_count = 0
         self.error_count = 0
-        self.errors: List[Dict[str, Any]] = []
+        self.error_sink = error_sink or ErrorSink()
+        self.unchanged_count = 0
+        self.inserted_count = 0
+        self.updated_count = 0
+        self.incremental = False
+        self.resumed_rows = 0
+        self.resumed_success = 0
+        self.dialect = None
+        self.writers: List[Dict[str, Any]] = []
         self.start_time = datetime.now()
         self.end_time = None
 
-    def add_success(self):
-        self.success_count += 1
+    def add_rows(self, source: pd.DataFrame):
+        self.total_rows += len(source)
+        if self.dialect is None:
+            self.dialect = source.attrs.get('dialect')
+
+    def add_success(self, count: int = 1):
+        self.success_count += count
+
+    def add_unchanged(self, count: int):
+        self.incremental = True
+        self.unchanged_count += count
+
+    def add_changes(self, inserted: int, updated: int):
+        self.inserted_count += inserted
+        self.updated_count += updated
+
+    @property
+    def errors(self) -> List[Dict[str, Any]]:
+        # Только образец: полный список ошибок - в файле отказов
+        return self.error_sink.sample
 
     def add_error(self, row_num: int, error: str, row_data: Dict = None):
         self.error_count += 1
-        self.errors.append({
-            'row': row_num,
-            'error': error,
-            'data': row_data
+        self.error_sink.add(row_num, error, row_data)
+
+    def merge_writer(self, name: str, writer: 'ETLStats'):
+        # Ошибки потоков записи уже в общем error_sink
+        self.success_count += writer.success_count
+        self.error_count += writer.error_count
+        self.inserted_count += writer.inserted_count
+        self.updated_count += writer.updated_count
+        self.writers.append({
+            'name': name,
+            'rows': writer.success_count,
+            'duration': writer.get_duration(),
+            'rows_per_second': writer.get_rows_per_second(),
         })
 
+    def snapshot(self, offset: int) -> Dict[str, Any]:
+        # Состояние на момент, когда обработаны первые offset строк файла
+        errors = self.error_sink.snapshot(offset)
+        error_count = sum(errors['categories'].values())
+        return {
+            'total_rows': offset,
+            'success_count': self.success_count,
+            'error_count': error_count,
+            'unchanged_count': offset - self.success_count - error_count if self.incremental else 0,
+            'inserted_count': self.inserted_count,
+            'updated_count': self.updated_count,
+            'incremental': self.incremental,
+            'dialect': self.dialect,
+            'errors': errors,
+        }
+
+    @classmethod
+    def restore(cls, snapshot: Dict[str, Any], error_sink: Optional[ErrorSink] = None) -> 'ETLStats':
+        stats = cls(error_sink)
+        for name, value in snapshot.items():
+            if name == 'errors':
+                stats.error_sink.restore(value)
+            else:
+                setattr(stats, name, value)
+        stats.resumed_rows = stats.total_rows
+        stats.resumed_success = stats.success_count
+        return stats
+
     def finish(self):
         self.end_time = datetime.now()
 
@@ -42,6 +115,12 @@ class ETLStats:
             return (self.end_time - self.start_time).total_seconds()
         return 0
 
+    def get_rows_per_second(self) -> float:
+        duration = self.get_duration()
+        if duration > 0:
+            return (self.success_count - self.resumed_success) / duration
+        return 0
+
     def __str__(self):
         duration = self.get_duration()
         return (
@@ -51,87 +130,255 @@ class ETLStats:
             f"Всего строк обработано: {self.total_rows}\n"
             f"Успешно загружено: {self.success_count}\n"
             f"Ошибок: {self.error_count}\n"
-            f"Время выполнения: {duration:.2f} сек\n"
-            f"${LINE}\n"
+            + (f"Без изменений: {self.unchanged_count}\n"
+               f"Добавлено: {self.inserted_count}\n"
+               f"Обновлено: {self.updated_count}\n" if self.incremental else "")
+            + f"Время выполнения: {duration:.2f} сек\n"
+            f"Скорость загрузки: {self.get_rows_per_second():.1f} строк/сек\n"
+            + (f"Продолжено после строки: {self.resumed_rows}\n" if self.resumed_rows else "")
+            + (f"Формат CSV: {self.dialect}\n" if self.dialect else "")
+            + "".join(
+                f"Поток записи {writer['name']}: {writer['rows']} строк, "
+                f"{writer['rows_per_second']:.1f} строк/сек\n"
+                for writer in self.writers
+            )
+            + f"${LINE}\n"
         )
 
 
 def load_data(df: pd.DataFrame, model_class: Type[SQLModel],
-              column_mapping: Dict[str, str]) -> ETLStats:
-    stats = ETLStats()
-    stats.total_rows = len(df)
-
-    logger.info(f"Начало загрузки {stats.total_rows} строк в таблицу {model_class.__tablename__}")
+              column_mapping: Dict[str, str],
+              batch_size: int = DEFAULT_BATCH_SIZE,
+              fk_cache: Optional[ForeignKeyCache] = None,
+              upsert_key: Optional[List[str]] = None,
+              hash_store: Optional[HashStore] = None,
+              stats: Optional[ETLStats] = None,
+              checkpoint: Optional[Checkpoint] = None,
+              personas: Optional[PersonaIndex] = None) -> ETLStats:
+    stats = stats or ETLStats()
+
+    logger.info(f"Начало {'обновления' if upsert_key else 'загрузки'} {len(df)} строк в таблицу {model_class.__tablename__} "
+                f"(размер пачки: {batch_size})")
 
     with session_scope() as session:
-        for idx, row in df.iterrows():
-            row_num = idx + 1
-
-            try:
-                data = transform_row(row, column_mapping)
-
-                if not data:
-                    logger.warning(f"Строка {row_num}: нет данных для загрузки")
-                    stats.add_error(row_num, "Нет данных для загрузки", dict(row))
-                    continue
-
-                validate_entity(data)
-
-                if model_class is Client or model_class is Driver:
-                    logger.error(str(data))
-                    persona = Persona(**data)
-                    logger.error(str(persona))
-                    create_entity_s(session, persona)
-                    logger.error(str(persona))
-                    data['id_клиента'] = persona.id
-
-                entity = model_class(**data)
-                create_entity_s(session, entity)
-                stats.add_success()
-
-                if stats.success_count % 10 == 0:
-                    logger.info(f"Загружено {stats.success_count}/{stats.total_rows} строк")
-
-            except IntegrityError as e:
-                error_msg = f"Ошибка целостности данных: {str(e)}"
-                logger.error(f"Строка {row_num}: {error_msg}")
-                stats.add_error(row_num, error_msg, dict(row))
-                session.rollback()
-
-            except Exception as e:
-                error_msg = f"{type(e).__name__}: {str(e)}"
-                logger.error(f"Строка {row_num}: {error_msg}")
-                stats.add_error(row_num, error_msg, dict(row))
-                session.rollback()
+        result = prepare_frame(df, column_mapping, field_types(model_class))
+        load_chunk(session, model_class, df, result, stats, batch_size,
+                   fk_cache, upsert_key, hash_store, checkpoint, personas)
 
     stats.finish()
 
     return stats
 
 
-def validate_data(df: pd.DataFrame, model_class: Type[SQLModel],
-                  column_mapping: Dict[str, str]) -> ETLStats:
-    stats = ETLStats()
-    stats.total_rows = len(df)
+def load_chunk(session, model_class: Type[SQLModel], source: pd.DataFrame,
+               result: TransformResult, stats: ETLStats,
+               batch_size: int = DEFAULT_BATCH_SIZE,
+               fk_cache: Optional[ForeignKeyCache] = None,
+               upsert_key: Optional[List[str]] = None,
+               hash_store: Optional[HashStore] = None,
+               checkpoint: Optional[Checkpoint] = None,
+               personas: Optional[PersonaIndex] = None):
+    batches = split_batches(model_class, source, result, stats, batch_size,
+                            fk_cache, hash_store, personas)
+    for number, batch in enumerate(batches, 1):
+        load_batch(session, model_class, source, batch, stats,
+                   fk_cache, upsert_key, hash_store, personas)
+        logger.info(f"Загружено {stats.success_count}/{stats.total_rows} строк")
+        if checkpoint is not None and number < len(batches):
+            checkpoint.save(batch[-1][0], stats)
+
+    if checkpoint is not None and len(source):
+        # После последней пачки порция обработана целиком, включая строки с ошибками в конце
+        checkpoint.save(int(source.index[-1]) + 1, stats)
+
+
+def split_batches(model_class: Type[SQLModel], source: pd.DataFrame, result: TransformResult,
+                  stats: ETLStats, batch_size: int = DEFAULT_BATCH_SIZE,
+                  fk_cache: Optional[ForeignKeyCache] = None,
+                  hash_store: Optional[HashStore] = None,
+                  personas: Optional[PersonaIndex] = None) -> List[List[Tuple[int, Dict[str, Any]]]]:
+    errors = result.errors
+    if fk_cache is not None:
+        # Ссылки на несуществующие записи отсекаются до записи в БД
+        with stage('fk_check', len(source)):
+            errors = combine_errors(errors, fk_cache.check(model_class, result.data))
+    if personas is not None:
+        # Повтор телефона в файле - ошибка, телефон из БД - привязка к существующей персоне
+        with stage('dedup', len(source)):
+            duplicates, persona_ids = personas.resolve(result.data, errors)
+            errors = combine_errors(errors, duplicates)
+
+    stats.add_rows(source)
+    _add_errors(stats, source, errors, log=True)
+    data = result.data[errors.isna()]
+    if personas is not None:
+        persona_ids = persona_ids[errors.isna()].astype(object)
+        data = data.assign(**{PERSONA_ID: persona_ids.where(persona_ids.notna(), None)})
+    if hash_store is not None:
+        # Строки, не изменившиеся с прошлого импорта, в БД не отправляются
+        with stage('hash', len(data)):
+            changed = hash_store.changed_rows(data)
+        stats.add_unchanged(int((~changed).sum()))
+        data = data[changed]
+
+    rows = list(_iter_rows(data))
+    return [rows[start:start + batch_size] for start in range(0, len(rows), batch_size)]
+
+
+def load_batch(session, model_class: Type[SQLModel], source: pd.DataFrame,
+               batch: List[Tuple[int, Dict[str, Any]]], stats: ETLStats,
+               fk_cache: Optional[ForeignKeyCache] = None,
+               upsert_key: Optional[List[str]] = None,
+               hash_store: Optional[HashStore] = None,
+               personas: Optional[PersonaIndex] = None):
+    # upsert_key задаёт режим upsert: строки с уже существующим ключом обновляются
+    with stage('write', len(batch)):
+        committed = _insert_bisect(session, model_class, source, batch, stats, fk_cache, upsert_key)
+    with stage('commit', len(batch)):
+        session.commit()
+
+    if hash_store is not None:
+        hash_store.commit([row_num for row_num, _ in batch], committed)
+    if personas is not None:
+        personas.commit([row_num for row_num, _ in batch], committed)
+
+
+def _insert_bisect(session, model_class: Type[SQLModel], source: pd.DataFrame,
+                   batch: List[Tuple[int, Dict[str, Any]]], stats: ETLStats,
+                   fk_cache: Optional[ForeignKeyCache] = None,
+                   upsert_key: Optional[List[str]] = None) -> List[int]:
+    try:
+        with session.begin_nested():
+            rows = [data for _, data in batch]
+            if upsert_key:
+                inserted_keys, inserted = upsert_batch(session, model_class, rows, upsert_key)
+            else:
+                inserted_keys, inserted = _insert_batch(session, model_class, rows, fk_cache), len(batch)
+        stats.add_success(len(batch))
+        stats.add_changes(inserted, len(batch) - inserted)
+        if fk_cache is not None:
+            for model, keys in inserted_keys:
+                fk_cache.register(model, keys)
+        return [row_num for row_num, _ in batch]
+
+    except IntegrityError as e:
+        error_msg = f"Ошибка целостности данных: {str(e)}"
+
+    except Exception as e:
+        error_msg = f"{type(e).__name__}: {str(e)}"
+
+    if len(batch) == 1:
+        row_num, _ = batch[0]
+        _add_error(stats, source, row_num, error_msg, log=True)
+        return []
+
+    # Откатывается только SAVEPOINT пачки: делим её пополам, пока не найдём плохие строки
+    middle = len(batch) // 2
+    return (_insert_bisect(session, model_class, source, batch[:middle], stats, fk_cache, upsert_key)
+            + _insert_bisect(session, model_class, source, batch[middle:], stats, fk_cache, upsert_key))
+
+
+def _insert_batch(session, model_class: Type[SQLModel], rows: List[Dict[str, Any]],
+                  fk_cache: Optional[ForeignKeyCache] = None) -> List[Tuple[Type[SQLModel], List[int]]]:
+    if model_class is Client or model_class is Driver:
+        # Сначала пачка персон одним запросом (OUTPUT INSERTED в MSSQL, RETURNING в SQLite):
+        # id возвращаются вместе с именем и телефоном и по ним сопоставляются строкам,
+        # затем пачка клиентов/водителей. Строки с найденной персоной привязываются к ней без вставки
+        new_rows = [data for data in rows if data.get(PERSONA_ID) is None]
+        new_ids = []
+        if new_rows:
+            params = [_model_fields(Persona, data, exclude=('id',)) for data in new_rows]
+            returned = session.execute(
+                _bulk_insert(Persona).returning(Persona.id, Persona.name, Persona.phone), params
+            ).all()
+            new_ids = [key[0] for key in match_returned_keys(params, returned, ['name', 'phone'])]
+        created = iter(new_ids)
+        persona_ids = [next(created) if data.get(PERSONA_ID) is None else int(data[PERSONA_ID])
+                       for data in rows]
+        session.execute(_bulk_insert(model_class), [
+            {**_model_fields(model_class, data), 'id': persona_id}
+            for data, persona_id in zip(rows, persona_ids)
+        ])
+        return [(Persona, new_ids), (model_class, persona_ids)]
+
+    statement = _bulk_insert(model_class)
+    params = [_model_fields(model_class, data) for data in rows]
+
+    if fk_cache is not None and fk_cache.tracks(model_class):
+        # На таблицу ссылаются другие загрузки прогона: забираем новые ключи
+        primary_key = model_class.__mapper__.primary_key[0]
+        key_attr = getattr(model_class, model_class.__mapper__.get_property_by_column(primary_key).key)
+        keys = session.scalars(statement.returning(key_attr), params).all()
+        return [(model_class, keys)]
+
+    session.execute(statement, params)
+    return []
+
+
+def _bulk_insert(model_class: Type[SQLModel]):
+    # Без render_nulls ORM выбрасывает None из строк и делит пачку на executemany
+    # по наборам заполненных колонок
+    return insert(model_class).execution_options(render_nulls=True)
+
+
+def _model_fields(model_class: Type[SQLModel], data: Dict[str, Any],
+                  exclude: Tuple[str, ...] = ()) -> Dict[str, Any]:
+    fields = {}
+    for field, value in data.items():
+        if field in model_class.model_fields and field not in exclude:
+            # numpy-скаляры из DataFrame не принимаются драйвером БД
+            fields[field] = value.item() if hasattr(value, 'item') else value
+    return fields
+
+
+def _iter_rows(data: pd.DataFrame) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    # Пустые значения остаются в строке как None: у всех строк пачки один набор колонок,
+    # и пачка уходит одним executemany, а не отдельной инструкцией на каждый набор
+    for idx, record in zip(data.index, data.to_dict('records')):
+        yield idx + 1, record
+
+
+def _add_errors(stats: ETLStats, source: pd.DataFrame, errors: pd.Series, log: bool = False):
+    for idx, error in errors.dropna().items():
+        _add_error(stats, source, idx + 1, error, log)
+
+
+def _add_error(stats: ETLStats, source: pd.DataFrame, row_num: int, error: str, log: bool = False):
+    # Данные строки собираются, только если они попадут в образец или в файл отказов.
+    # В лог пишутся ошибки, попадающие в образец
+    sink = stats.error_sink
+    if log and sink.samples(row_num):
+        logger.error(f"Строка {row_num}: {error}")
+    stats.add_error(row_num, error, _row_data(source, row_num) if sink.needs_data(row_num) else None)
+
+
+def _row_data(source: pd.DataFrame, row_num: int) -> Dict[str, Any]:
+    return dict(source.loc[row_num - 1])
 
-    logger.info(f"Начало валидации {stats.total_rows} строк")
 
-    for idx, row in df.iterrows():
-        row_num = idx + 1
-        try:
-            data = transform_row(row, column_mapping)
-            if not data:
-                stats.add_error(row_num, "Нет данных", dict(row))
-                continue
+def validate_data(df: pd.DataFrame, model_class: Type[SQLModel],
+                  column_mapping: Dict[str, str],
+                  stats: Optional[ETLStats] = None,
+                  fk_cache: Optional[ForeignKeyCache] = None) -> ETLStats:
+    stats = stats or ETLStats()
 
-            validate_entity(data)
-            model_class(**data)
-            stats.add_success()
+    logger.info(f"Начало валидации {len(df)} строк")
 
-        except Exception as e:
-            error_msg = f"{type(e).__name__}: {str(e)}"
-            stats.add_error(row_num, error_msg, dict(row))
+    validate_chunk(model_class, df, prepare_frame(df, column_mapping, field_types(model_class)),
+                   stats, fk_cache)
 
     stats.finish()
 
     return stats
+
+
+def validate_chunk(model_class: Type[SQLModel], source: pd.DataFrame, result: TransformResult,
+                   stats: ETLStats, fk_cache: Optional[ForeignKeyCache] = None):
+    errors = result.errors
+    if fk_cache is not None:
+        # Кэш ключей только читает БД: висячие ссылки видны и без загрузки
+        with stage('fk_check', len(source)):
+            errors = combine_errors(errors, fk_cache.check(model_class, result.data))
+    stats.add_rows(source)
+    _add_errors(stats, source, errors)
+    stats.add_success(int(errors.isna().sum()))
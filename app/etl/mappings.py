@@ -1,3 +1,7 @@
+from typing import Any, Dict, Optional, Type, Union, get_args, get_origin
+
+from sqlmodel import SQLModel
+
 from app.models import (
     Persona, Client, Driver, Geoposition, Review,
     Car, CarType, OrderStatus, Order, Payment
@@ -158,3 +162,38 @@ COLUMN_MAPPINGS = {
     },
 }
 LINE = f"{'=' * 60}"
+
+# Текстовые поля читаются строками, чтобы телефоны и номера лицензий не становились
+# числами. Остальное читается как есть (object) и разбирается в transformer: одна
+# нечисловая ячейка в числовой колонке - ошибка строки, а не повторный разбор всего файла
+FILE_DTYPES = {
+    str: str,
+}
+
+
+def field_types(model_class: Type[SQLModel]) -> Dict[str, type]:
+    models = [model_class]
+    if model_class is Client or model_class is Driver:
+        # Клиент и водитель загружаются вместе со своей персоной
+        models.insert(0, Persona)
+
+    types = {}
+    for model in models:
+        for name, field in model.model_fields.items():
+            types[name] = _unwrap_optional(field.annotation)
+    return types
+
+
+def file_dtypes(model_class: Type[SQLModel], column_mapping: Dict[str, str]) -> Dict[str, Any]:
+    types = field_types(model_class)
+    return {
+        file_col: FILE_DTYPES.get(types.get(model_field), object)
+        for file_col, model_field in column_mapping.items()
+    }
+
+
+def _unwrap_optional(annotation: Any) -> Optional[type]:
+    if get_origin(annotation) is Union:
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        return args[0] if len(args) == 1 else None
+    return annotation
@@ -0,0 +1,91 @@
+import logging
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+
+from app.database import check_indexes, session_scope
+from app.etl.foreign_keys import KeySet
+from app.etl.upsert import LOOKUP_SIZE
+from app.models import Persona, normalize_phone, phone_variants
+
+logger = logging.getLogger(__name__)
+
+PERSONA_ID = 'persona_id'
+DUPLICATE_PHONE = "Поле 'phone': телефон уже встречался в файле"
+
+
+class PersonaIndex:
+    # Дедупликация персон при импорте клиентов и водителей. Нормализованный телефон
+    # хранится хэшем строки: повтор в файле - ошибка строки, телефон существующей персоны -
+    # привязка к ней вместо создания новой. До коммита строки телефон числится за её номером
+    def __init__(self):
+        self._seen = KeySet(np.empty(0, dtype=np.int64))
+        self._pending: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        check_indexes()
+
+    def resolve(self, data: pd.DataFrame, errors: pd.Series) -> Tuple[pd.Series, pd.Series]:
+        # Возвращает ошибки повторов и id найденных в БД персон (NA - персона новая)
+        duplicates = pd.Series(None, index=data.index, dtype=object)
+        persona_ids = pd.Series(pd.NA, index=data.index, dtype='Int64')
+        if 'phone' not in data.columns:
+            return duplicates, persona_ids
+
+        # Строки с другими ошибками не загрузятся и телефон не занимают
+        phone = data['phone'][errors.isna() & data['phone'].notna()]
+        digits = _normalize_phones(phone.astype(str))
+        digits = digits[digits.str.len() > 0]
+        # Хэш строки, а не число: номера, различающиеся ведущими нулями, не совпадают
+        hashes = pd.Series(pd.util.hash_pandas_object(digits, index=False).to_numpy().view(np.int64),
+                           index=digits.index)
+
+        with self._lock:
+            pending = np.fromiter(self._pending.values(), dtype=np.int64, count=len(self._pending))
+            repeated = (hashes.duplicated() | self._seen.contains(hashes)
+                        | pd.Series(np.isin(hashes.to_numpy(), pending), index=hashes.index))
+            for idx, phone_hash in hashes[~repeated].items():
+                self._pending[idx + 1] = int(phone_hash)
+        duplicates[repeated.index[repeated]] = DUPLICATE_PHONE
+
+        found = _find_personas(digits[~repeated].unique())
+        if found:
+            ids = digits[~repeated].map(found).dropna()
+            persona_ids[ids.index] = ids.astype(np.int64)
+            logger.info(f"Найдено существующих персон: {len(ids)}")
+
+        return duplicates, persona_ids
+
+    def commit(self, row_nums: List[int], committed: List[int]):
+        # Телефоны строк, не попавших в БД, освобождаются
+        committed = set(committed)
+        hashes = []
+        with self._lock:
+            for row_num in row_nums:
+                phone_hash = self._pending.pop(row_num, None)
+                if phone_hash is not None and row_num in committed:
+                    hashes.append(phone_hash)
+            self._seen.add(hashes)
+
+
+def _normalize_phones(phone: pd.Series) -> pd.Series:
+    # То же, что normalize_phone, для всей колонки сразу
+    digits = phone.str.replace(r'\D', '', regex=True)
+    eight = (digits.str.len() == 11) & digits.str.startswith('8')
+    return digits.mask(eight, '7' + digits.str[1:])
+
+
+def _find_personas(digits: np.ndarray) -> Dict[str, int]:
+    # Один запрос IN на LOOKUP_SIZE написаний номеров, поиск по индексу Персона.телефон
+    variants = [variant for number in digits for variant in phone_variants(number)]
+    found = {}
+    with session_scope() as session:
+        for start in range(0, len(variants), LOOKUP_SIZE):
+            chunk = variants[start:start + LOOKUP_SIZE]
+            query = select(Persona.id, Persona.phone).where(Persona.phone.in_(chunk))
+            for persona_id, phone in session.execute(query):
+                number = normalize_phone(phone)
+                found[number] = min(found.get(number, persona_id), persona_id)
+    return found
@@ -0,0 +1,245 @@
+import logging
+import math
+import multiprocessing
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Type
+
+import pandas as pd
+from sqlmodel import SQLModel
+
+from app.database import session_scope
+from app.etl.checkpoint import Checkpoint
+from app.etl.foreign_keys import ForeignKeyCache
+from app.etl.hash_store import HashStore
+from app.etl.loader import (
+    ETLStats, DEFAULT_BATCH_SIZE, load_batch, load_chunk, split_batches, validate_chunk
+)
+from app.etl.mappings import field_types
+from app.etl.personas import PersonaIndex
+from app.etl.profiling import stage
+from app.etl.transformer import TransformResult, prepare_frame
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_DEPTH = 2
+MIN_SHARD_ROWS = 1000
+
+_DONE = object()
+
+
+class _StageError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def run_pipeline(chunks: Iterable[pd.DataFrame], model_class: Type[SQLModel],
+                 column_mapping: Dict[str, str],
+                 validate_only: bool = False,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 queue_depth: int = DEFAULT_QUEUE_DEPTH,
+                 workers: int = 1,
+                 writers: int = 1,
+                 fk_cache: Optional[ForeignKeyCache] = None,
+                 upsert_key: Optional[List[str]] = None,
+                 hash_store: Optional[HashStore] = None,
+                 stats: Optional[ETLStats] = None,
+                 checkpoint: Optional[Checkpoint] = None,
+                 personas: Optional[PersonaIndex] = None) -> ETLStats:
+    # Чтение, преобразование и запись идут в разных потоках. Очереди ограничены,
+    # поэтому в памяти одновременно порядка 3 * queue_depth порций.
+    # С workers > 1 порции режутся на диапазоны строк и преобразуются в процессах.
+    # С writers > 1 пачки пишутся в БД через несколько соединений из пула.
+    # Контрольные точки пишутся только одним потоком записи: пачки коммитятся по порядку.
+    stats = stats or ETLStats()
+    stop = threading.Event()
+    read_queue = queue.Queue(maxsize=queue_depth)
+    transform_queue = queue.Queue(maxsize=queue_depth)
+
+    types = field_types(model_class)
+
+    logger.info(f"Потоковая {'валидация' if validate_only else 'загрузка'} "
+                f"в таблицу {model_class.__tablename__} (глубина очереди: {queue_depth}, "
+                f"процессов преобразования: {workers}, потоков записи: {writers})")
+
+    with _transform_pool(workers) as executor:
+        def transform(items: Iterator[pd.DataFrame]):
+            if executor is None:
+                return ((chunk, prepare_frame(chunk, column_mapping, types)) for chunk in items)
+            return _prepare_parallel(items, executor, workers, queue_depth, column_mapping, types)
+
+        threads = [
+            threading.Thread(target=_produce, args=(iter(chunks), read_queue, stop),
+                             name='etl-read', daemon=True),
+            threading.Thread(target=_process, args=(read_queue, transform_queue, transform, stop),
+                             name='etl-transform', daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            results = _consume(transform_queue, stop)
+            if validate_only:
+                for source, result in results:
+                    validate_chunk(model_class, source, result, stats, fk_cache)
+            elif writers > 1:
+                _write_parallel(results, model_class, stats, batch_size, writers, stop,
+                                fk_cache, upsert_key, hash_store, personas)
+            else:
+                with session_scope() as session:
+                    for source, result in results:
+                        load_chunk(session, model_class, source, result, stats, batch_size,
+                                   fk_cache, upsert_key, hash_store, checkpoint, personas)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    stats.finish()
+
+    return stats
+
+
+def _transform_pool(workers: int):
+    if workers <= 1:
+        return nullcontext()
+    # spawn: дочерние процессы не наследуют потоки чтения и соединения с БД
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _write_parallel(results: Iterator[Tuple[pd.DataFrame, TransformResult]],
+                    model_class: Type[SQLModel], stats: ETLStats, batch_size: int,
+                    writers: int, stop: threading.Event,
+                    fk_cache: Optional[ForeignKeyCache] = None,
+                    upsert_key: Optional[List[str]] = None,
+                    hash_store: Optional[HashStore] = None,
+                    personas: Optional[PersonaIndex] = None):
+    # Каждый поток записи берёт своё соединение из пула и сам коммитит свои пачки
+    batch_queue = queue.Queue(maxsize=writers * 2)
+    writer_stats = [ETLStats(stats.error_sink) for _ in range(writers)]
+    failures = []
+
+    threads = [
+        threading.Thread(target=_write_batches,
+                         args=(batch_queue, model_class, writer_stats[i], stop, failures,
+                               fk_cache, upsert_key, hash_store, personas),
+                         name=f'etl-write-{i + 1}', daemon=True)
+        for i in range(writers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for source, result in results:
+            for batch in split_batches(model_class, source, result, stats, batch_size,
+                                       fk_cache, hash_store, personas):
+                if not _put(batch_queue, (source, batch), stop):
+                    break
+        for _ in threads:
+            _put(batch_queue, _DONE, stop)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+
+    for i, writer in enumerate(writer_stats, 1):
+        stats.merge_writer(str(i), writer)
+
+    if failures:
+        raise failures[0]
+
+
+def _write_batches(batches: queue.Queue, model_class: Type[SQLModel], stats: ETLStats,
+                   stop: threading.Event, failures: list,
+                   fk_cache: Optional[ForeignKeyCache] = None,
+                   upsert_key: Optional[List[str]] = None,
+                   hash_store: Optional[HashStore] = None,
+                   personas: Optional[PersonaIndex] = None):
+    try:
+        with session_scope() as session:
+            for source, batch in _consume(batches, stop):
+                load_batch(session, model_class, source, batch, stats,
+                           fk_cache, upsert_key, hash_store, personas)
+                logger.info(f"Поток записи {threading.current_thread().name}: "
+                            f"загружено {stats.success_count} строк")
+    except BaseException as e:
+        failures.append(e)
+        stop.set()
+    finally:
+        stats.finish()
+
+
+def _prepare_parallel(chunks: Iterator[pd.DataFrame], executor: Executor, workers: int,
+                      queue_depth: int, column_mapping: Dict[str, str],
+                      types: Dict[str, type]) -> Iterator[Tuple[pd.DataFrame, TransformResult]]:
+    pending = deque()
+
+    for chunk in chunks:
+        shard_size = max(MIN_SHARD_ROWS, math.ceil(len(chunk) / workers))
+        futures = [
+            executor.submit(prepare_frame, chunk.iloc[start:start + shard_size], column_mapping, types)
+            for start in range(0, len(chunk), shard_size)
+        ]
+        pending.append((chunk, futures))
+
+        # Следующие порции уже считаются, пока ждём самую старую
+        if len(pending) > queue_depth:
+            yield _merge_shards(*pending.popleft())
+
+    while pending:
+        yield _merge_shards(*pending.popleft())
+
+
+def _merge_shards(chunk: pd.DataFrame, futures) -> Tuple[pd.DataFrame, TransformResult]:
+    # Время этапов внутри процессов не собирается, учитывается только ожидание результата
+    with stage('transform_wait', len(chunk)):
+        results = [future.result() for future in futures]
+    if not results:
+        return chunk, prepare_frame(chunk, {})
+    data = pd.concat([result.data for result in results])
+    errors = pd.concat([result.errors for result in results])
+    return chunk, TransformResult(data, errors)
+
+
+def _produce(items: Iterator[Any], output: queue.Queue, stop: threading.Event):
+    try:
+        for item in items:
+            if not _put(output, item, stop):
+                return
+    except BaseException as e:
+        _put(output, _StageError(e), stop)
+        return
+    _put(output, _DONE, stop)
+
+
+def _process(source: queue.Queue, output: queue.Queue,
+             step: Callable[[Iterator[Any]], Iterator[Any]], stop: threading.Event):
+    _produce(step(_consume(source, stop)), output, stop)
+
+
+def _consume(source: queue.Queue, stop: threading.Event) -> Iterator[Any]:
+    while not stop.is_set():
+        try:
+            item = source.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            return
+        if isinstance(item, _StageError):
+            raise item.error
+        yield item
+
+
+def _put(output: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            output.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
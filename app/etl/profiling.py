@@ -0,0 +1,279 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from sqlalchemy import event
+
+from app.etl.mappings import LINE
+
+logger = logging.getLogger(__name__)
+
+TOP_ALLOCATIONS = 10
+# Как часто опрашивается RSS процесса во время прогона, сек
+RSS_INTERVAL = 0.02
+
+# Профиль текущего прогона. Этапы в потоках чтения и записи пишут в него же,
+# в процессах преобразования (--workers > 1) профиля нет
+_current: Optional['RunProfile'] = None
+# Открытые этапы своего потока: обращение к БД засчитывается самому вложенному
+_active = threading.local()
+
+
+class RunProfile:
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.round_trips = 0
+        self.executemany_count = 0
+        self.statements: Dict[str, int] = {}
+        self.db_seconds = 0.0
+        self.stage_round_trips: Dict[str, int] = {}
+        self.outside_round_trips = 0
+        self.trace_memory = True
+        self.trace_database = True
+        self.top_allocations = []
+        self.traced_peak = 0
+        self.rss: Optional[RssSampler] = None
+        self.start_time = datetime.now()
+        self.end_time = None
+        self._lock = threading.Lock()
+        self._started = threading.local()
+
+    def add(self, name: str, seconds: float, rows: int = 0):
+        with self._lock:
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'rows': 0})
+            stage['seconds'] += seconds
+            stage['calls'] += 1
+            stage['rows'] += rows
+
+    def get_duration(self) -> float:
+        if self.end_time:
+            return (self.end_time - self.start_time).total_seconds()
+        return 0
+
+    def report(self, stats, **run) -> Dict[str, Any]:
+        duration = self.get_duration()
+        return {
+            'run': run,
+            'started': self.start_time.isoformat(),
+            'duration_seconds': duration,
+            'rows': {
+                'total': stats.total_rows,
+                'success': stats.success_count,
+                'errors': stats.error_count,
+                'unchanged': stats.unchanged_count,
+                'resumed': stats.resumed_rows,
+            },
+            'rows_per_second': stats.get_rows_per_second(),
+            'error_categories': dict(stats.error_sink.categories),
+            'stages': {
+                name: {
+                    **stage,
+                    'rows_per_second': stage['rows'] / stage['seconds'] if stage['seconds'] else 0,
+                    'round_trips': self.stage_round_trips.get(name, 0) if self.trace_database else None,
+                }
+                for name, stage in self.stages.items()
+            },
+            'memory': {
+                'peak_rss_mb': self.rss.peak_mb if self.rss else None,
+                'start_rss_mb': self.rss.start_mb if self.rss else None,
+                'process_peak_rss_mb': peak_rss_mb(),
+                'tracemalloc_peak_mb': self.traced_peak / 1024 ** 2 if self.trace_memory else None,
+                'top_allocations': self.top_allocations if self.trace_memory else None,
+            },
+            'database': {
+                'round_trips': self.round_trips,
+                'outside_stages': self.outside_round_trips,
+                'executemany': self.executemany_count,
+                'statements': self.statements,
+                'seconds': self.db_seconds,
+            } if self.trace_database else None,
+        }
+
+    def write(self, path: str, stats, **run):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.report(stats, **run), file, ensure_ascii=False, indent=2, default=str)
+        logger.info(f"Отчёт о прогоне записан в {path}")
+
+    def __str__(self):
+        rss = self.rss.peak_mb if self.rss else None
+        lines = [LINE, "ЭТАПЫ", LINE]
+        for name, stage in sorted(self.stages.items(), key=lambda item: -item[1]['seconds']):
+            rows_per_second = stage['rows'] / stage['seconds'] if stage['seconds'] else 0
+            lines.append(f"{name:14} {stage['seconds']:8.2f} сек  {stage['calls']:6} раз  "
+                         f"{rows_per_second:12.1f} строк/сек"
+                         + (f"  {self.stage_round_trips.get(name, 0):6} обращений к БД"
+                            if self.trace_database else ""))
+        lines.append(LINE)
+        if self.trace_database:
+            lines.append(f"Обращений к БД: {self.round_trips} (пакетных: {self.executemany_count}, "
+                         f"вне этапов: {self.outside_round_trips}), {self.db_seconds:.2f} сек")
+        lines += [
+            f"Пик памяти за прогон: {f'{rss:.1f} МБ' if rss is not None else 'нет данных'}"
+            + (f", пик tracemalloc: {self.traced_peak / 1024 ** 2:.1f} МБ" if self.trace_memory else ""),
+            LINE,
+        ]
+        return "\n".join(lines) + "\n"
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._started.value = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - getattr(self._started, 'value', time.perf_counter())
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else '?'
+        stages = getattr(_active, 'stages', None)
+        with self._lock:
+            self.round_trips += 1
+            self.executemany_count += int(executemany)
+            self.statements[kind] = self.statements.get(kind, 0) + 1
+            self.db_seconds += seconds
+            if stages:
+                self.stage_round_trips[stages[-1]] = self.stage_round_trips.get(stages[-1], 0) + 1
+            else:
+                self.outside_round_trips += 1
+
+
+@contextmanager
+def profiled(profile: Optional[RunProfile], trace_memory: bool = True, trace_database: bool = True):
+    # Включает сбор профиля на время прогона: таймеры этапов, RSS, tracemalloc и события движка БД.
+    # tracemalloc и события БД замедляют импорт: для замера времени их можно выключить
+    global _current
+    if profile is None:
+        yield
+        return
+
+    from app.database import get_engine
+    engine = get_engine()
+
+    profile.trace_memory = trace_memory
+    profile.trace_database = trace_database
+    _current = profile
+    profile.rss = RssSampler().start()
+    if trace_memory:
+        tracemalloc.start()
+    if trace_database:
+        event.listen(engine, 'before_cursor_execute', profile._before_execute)
+        event.listen(engine, 'after_cursor_execute', profile._after_execute)
+    try:
+        yield
+    finally:
+        if trace_database:
+            event.remove(engine, 'before_cursor_execute', profile._before_execute)
+            event.remove(engine, 'after_cursor_execute', profile._after_execute)
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, profile.traced_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            profile.top_allocations = [
+                {'location': str(stat.traceback[0]), 'size_mb': stat.size / 1024 ** 2, 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+            ]
+        profile.rss.stop()
+        profile.end_time = datetime.now()
+        _current = None
+
+
+class StageTimer:
+    # rows можно задать внутри блока, если число строк известно только после этапа
+    def __init__(self, rows: int):
+        self.rows = rows
+
+
+@contextmanager
+def stage(name: str, rows: int = 0):
+    timer = StageTimer(rows)
+    profile = _current
+    if profile is None:
+        yield timer
+        return
+    if not hasattr(_active, 'stages'):
+        _active.stages = []
+    _active.stages.append(name)
+    start = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        _active.stages.pop()
+        profile.add(name, time.perf_counter() - start, timer.rows)
+
+
+def timed_chunks(chunks: Iterable[Any], name: str = 'read') -> Iterator[Any]:
+    # Время чтения порции - время получения её из генератора
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        if chunk is None:
+            return
+        profile = _current
+        if profile is not None:
+            profile.add(name, time.perf_counter() - start, len(chunk))
+        yield chunk
+
+
+class RssSampler:
+    # Пик RSS за один прогон. ru_maxrss - пик за всю жизнь процесса: после первого
+    # большого прогона он не меняется, поэтому RSS опрашивается в фоновом потоке
+    def __init__(self, interval: float = RSS_INTERVAL):
+        self.interval = interval
+        self.start_mb = current_rss_mb()
+        self.peak_mb = self.start_mb
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='etl-rss', daemon=True)
+
+    def start(self) -> 'RssSampler':
+        if self.start_mb is not None:
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self._sample()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is not None and (self.peak_mb is None or rss > self.peak_mb):
+            self.peak_mb = rss
+
+
+def current_rss_mb() -> Optional[float]:
+    try:
+        # Linux: второе поле - число резидентных страниц
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / 1024 ** 2
+
+
+def peak_rss_mb() -> Optional[float]:
+    # Пик за всю жизнь процесса, для отчёта о прогоне - RssSampler
+    try:
+        import resource
+    except ImportError:
+        # Windows: пик рабочего набора есть только у psutil
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 1024 ** 2
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS - байты
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
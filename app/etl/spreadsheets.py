@@ -0,0 +1,199 @@
+import zipfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from xml.etree.ElementTree import iterparse
+
+import pandas as pd
+from openpyxl import load_workbook
+
+# Построчное чтение таблиц: в памяти одна строка листа и одна порция DataFrame,
+# значения ячеек приводятся так же, как в pd.read_excel
+
+_table_ns = 'urn:oasis:names:tc:opendocument:xmlns:table:1.0'
+_office_ns = 'urn:oasis:names:tc:opendocument:xmlns:office:1.0'
+_text_ns = 'urn:oasis:names:tc:opendocument:xmlns:text:1.0'
+
+_table = f'{{{_table_ns}}}table'
+_table_row = f'{{{_table_ns}}}table-row'
+_table_cell = f'{{{_table_ns}}}table-cell'
+_covered_cell = f'{{{_table_ns}}}covered-table-cell'
+_rows_repeated = f'{{{_table_ns}}}number-rows-repeated'
+_columns_repeated = f'{{{_table_ns}}}number-columns-repeated'
+_value_type = f'{{{_office_ns}}}value-type'
+_value = f'{{{_office_ns}}}value'
+_date_value = f'{{{_office_ns}}}date-value'
+_boolean_value = f'{{{_office_ns}}}boolean-value'
+_paragraph = f'{{{_text_ns}}}p'
+_spaces = f'{{{_text_ns}}}s'
+_spaces_count = f'{{{_text_ns}}}c'
+
+
+def iter_xlsx_rows(file_path: str) -> Iterator[tuple]:
+    # read_only: openpyxl читает лист потоком, не строя всю книгу в памяти
+    workbook = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield tuple(_number(value) for value in row)
+    finally:
+        workbook.close()
+
+
+def iter_ods_rows(file_path: str) -> Iterator[List[Any]]:
+    # content.xml первого листа разбирается по событиям, прочитанные строки удаляются из дерева
+    with zipfile.ZipFile(file_path) as archive, archive.open('content.xml') as content:
+        parents = []
+        empty_rows = 0
+        in_table = False
+
+        for event, element in iterparse(content, events=('start', 'end')):
+            if event == 'start':
+                parents.append(element)
+                if element.tag == _table:
+                    in_table = True
+                continue
+
+            parents.pop()
+            if element.tag == _table and in_table:
+                return
+            if element.tag != _table_row or not in_table:
+                continue
+
+            row = _ods_row(element)
+            repeat = int(element.get(_rows_repeated, 1))
+            if parents:
+                parents[-1].remove(element)
+
+            if not row:
+                # Пустые строки отдаются, только если за ними есть данные:
+                # в конце листа они бывают повторены миллион раз
+                empty_rows += repeat
+                continue
+            for _ in range(empty_rows):
+                yield []
+            empty_rows = 0
+            for _ in range(repeat):
+                yield row
+
+
+def frame_chunks(rows: Iterable[Iterable[Any]], chunk_size: int,
+                 dtypes: Optional[Dict[str, Any]] = None,
+                 skip_rows: int = 0) -> Iterator[pd.DataFrame]:
+    # Первая строка - заголовок. Индекс считается от первой непропущенной строки данных
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+
+    names = [f"Unnamed: {i}" if name is None else name for i, name in enumerate(header)]
+    keep = [i for i, name in enumerate(names) if dtypes is None or name in dtypes]
+    columns = [names[i] for i in keep]
+    text_columns = [name for name in columns if dtypes is not None and dtypes[name] is str]
+
+    buffer = []
+    start = 0
+    position = 0
+    empty_rows = 0
+
+    for row in rows:
+        row = list(row)
+        if all(value is None for value in row):
+            # Пустые строки внутри листа остаются, чтобы номера строк совпадали с файлом,
+            # а хвостовые отбрасываются, как в pd.read_excel
+            empty_rows += 1
+            continue
+
+        row += [None] * (len(names) - len(row))
+        for values in [[None] * len(names)] * empty_rows + [row]:
+            position += 1
+            if position <= skip_rows:
+                continue
+            buffer.append([values[i] for i in keep])
+            if len(buffer) == chunk_size:
+                yield _frame(buffer, columns, text_columns, start)
+                start += len(buffer)
+                buffer = []
+        empty_rows = 0
+
+    if buffer or start == 0:
+        yield _frame(buffer, columns, text_columns, start)
+
+
+def _frame(buffer: List[List[Any]], columns: List[str], text_columns: List[str],
+           start: int) -> pd.DataFrame:
+    # Текстовые колонки приводятся к строкам до вывода типов, иначе телефоны станут float
+    df = pd.DataFrame(buffer, columns=columns, index=range(start, start + len(buffer)), dtype=object)
+    for name in text_columns:
+        column = df[name]
+        present = column.notna()
+        column[present] = column[present].astype(str)
+    other = [name for name in columns if name not in text_columns]
+    df[other] = df[other].infer_objects()
+    return df
+
+
+def _number(value: Any) -> Any:
+    # Как в pandas: целые числа, записанные как float, становятся int
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if value == '':
+        return None
+    return value
+
+
+def _ods_row(row) -> List[Any]:
+    values = []
+    empty_cells = 0
+
+    for cell in row:
+        if cell.tag not in (_table_cell, _covered_cell):
+            continue
+
+        value = _ods_value(cell) if cell.tag == _table_cell else None
+        repeat = int(cell.get(_columns_repeated, 1))
+
+        # Пустые ячейки дописываются, только если за ними есть значение
+        if value is None:
+            empty_cells += repeat
+        else:
+            values.extend([None] * empty_cells)
+            empty_cells = 0
+            values.extend([value] * repeat)
+
+    return values
+
+
+def _ods_value(cell) -> Any:
+    cell_type = cell.get(_value_type)
+    text = _ods_text(cell)
+
+    # Пустой текст - отсутствующее значение, как у парсера pandas
+    if text in ('', '#N/A') or cell_type is None:
+        return None
+    if cell_type == 'boolean':
+        return cell.get(_boolean_value) == 'true'
+    if cell_type == 'float':
+        return _number(float(cell.get(_value)))
+    if cell_type in ('percentage', 'currency'):
+        return float(cell.get(_value))
+    if cell_type == 'string':
+        return text
+    if cell_type == 'date':
+        return pd.Timestamp(cell.get(_date_value))
+    if cell_type == 'time':
+        return pd.Timestamp(text).time()
+    raise ValueError(f"Неизвестный тип ячейки ODS: {cell_type}")
+
+
+def _ods_text(cell) -> str:
+    # Абзацы примечаний (office:annotation) в значение не входят
+    return ''.join(_paragraph_text(paragraph) for paragraph in cell.findall(_paragraph))
+
+
+def _paragraph_text(element) -> str:
+    parts = [element.text or '']
+    for child in element:
+        if child.tag == _spaces:
+            parts.append(' ' * int(child.get(_spaces_count, 1)))
+        else:
+            parts.append(_paragraph_text(child))
+        parts.append(child.tail or '')
+    return ''.join(parts)
@@ -1,95 +1,246 @@
-from datetime import datetime
-from decimal import Decimal, InvalidOperation
-from typing import Any, Dict
+from decimal import Decimal
+from typing import Dict, NamedTuple, Optional, Tuple
 
 import pandas as pd
+from pandas.tseries.api import guess_datetime_format
 
-from app.models import (
-    validate_phone, validate_email, validate_past_date, validate_positive
-)
+from app.etl.profiling import stage
+from app.models import _phone_re, _email_re
 
 
-def transform_row(row: pd.Series, column_mapping: Dict[str, str]) -> Dict[str, Any]:
-    data = {}
+TRUE_VALUES = ['true', 'да', '1', 'yes', 'истина']
+FALSE_VALUES = ['false', 'нет', '0', 'no', 'ложь']
+
+DATE_FIELDS = ['registration_date', 'mark_time', 'creation_date', 'order_time',
+               'arrival_time', 'payment_date', 'birthday']
+POSITIVE_FIELDS = ['distance_m', 'passenger_count', 'amount']
+NUMERIC_TYPES = (int, float, Decimal)
+
+_int_pattern = r'^\s*[+-]?\d+\s*$'
+
+
+class TransformResult(NamedTuple):
+    data: pd.DataFrame
+    errors: pd.Series
+
+    @property
+    def error_mask(self) -> pd.Series:
+        return self.errors.notna()
+
+
+def transform_frame(df: pd.DataFrame, column_mapping: Dict[str, str],
+                    field_types: Optional[Dict[str, type]] = None) -> TransformResult:
+    field_types = field_types or {}
+    data = pd.DataFrame(index=df.index)
+    errors = pd.Series(None, index=df.index, dtype=object)
 
     for file_col, model_field in column_mapping.items():
-        if file_col in row.index:
-            value = row[file_col]
+        if file_col not in df.columns:
+            continue
 
-            if pd.isna(value):
-                continue
+        values, failed = _transform_column(df[file_col], model_field, field_types.get(model_field))
 
-            transformed_value = _transform_value(value, model_field)
+        if model_field in data.columns:
+            values = values.where(values.notna(), data[model_field])
+        data[model_field] = values
 
-            if transformed_value is not None:
-                data[model_field] = transformed_value
+        errors = errors.mask(failed & errors.isna(),
+                             _failure_message(model_field))
 
-    return data
+    if len(data.columns):
+        empty = data.isna().all(axis=1)
+    else:
+        empty = pd.Series(True, index=df.index)
+    errors = errors.mask(empty, "Нет данных для загрузки")
 
+    return TransformResult(data, errors.where(errors.notna(), None))
+
+
+def _transform_column(column: pd.Series, field_name: str,
+                      field_type: Optional[type] = None) -> Tuple[pd.Series, pd.Series]:
+    if field_type in (int, float) and not pd.api.types.is_numeric_dtype(column):
+        return _to_numbers(column, field_type)
 
-def _transform_value(value: Any, field_name: str) -> Any:
-    if isinstance(value, str):
-        value_lower = value.lower()
-        if value_lower in ['true', 'да', '1', 'yes', 'истина']:
-            return True
-        elif value_lower in ['false', 'нет', '0', 'no', 'ложь']:
-            return False
+    result = column.astype(object).where(column.notna(), None)
+    failed = pd.Series(False, index=column.index)
+
+    try:
+        lower = column.str.lower() if field_type is not str else None
+    except AttributeError:
+        lower = None
+
+    if lower is None:
+        if _is_date_field(field_name) and column.dtype.kind != 'M':
+            failed = column.notna()
+        return result, failed
+
+    pending = lower.notna()
 
-    if isinstance(value, str) and _is_date_field(field_name):
-        try:
-            return pd.to_datetime(value).to_pydatetime()
-        except Exception:
-            pass
+    is_true = pending & lower.isin(TRUE_VALUES)
+    is_false = pending & lower.isin(FALSE_VALUES)
+    result.loc[is_true] = True
+    result.loc[is_false] = False
+    pending &= ~(is_true | is_false)
 
-    if isinstance(value, str):
-        if field_name in ['amount', 'сумма']:
-            try:
-                return Decimal(value.replace(',', '.'))
-            except (InvalidOperation, ValueError):
-                pass
+    if _is_date_field(field_name):
+        is_date = pd.Series(False, index=column.index)
+        if pending.any():
+            parsed = _parse_dates(column[pending])
+            is_date = parsed.notna().reindex(column.index, fill_value=False)
+            result.loc[is_date] = parsed[parsed.notna()].astype(object)
+        failed = lower.notna() & ~is_date
+        pending &= ~is_date
 
-        try:
-            if '.' not in value and ',' not in value:
-                return int(value)
-        except ValueError:
-            pass
+    if not pending.any():
+        return result, failed
 
-        try:
-            return float(value.replace(',', '.'))
-        except ValueError:
-            pass
+    normalized = column[pending].str.replace(',', '.', regex=False)
+    numeric = pd.to_numeric(normalized, errors='coerce')
 
-    return value
+    if field_name in ['amount', 'сумма']:
+        is_amount = numeric.notna()
+        result.loc[is_amount.index[is_amount]] = normalized[is_amount].map(Decimal)
+        normalized = normalized[~is_amount]
+        numeric = numeric[~is_amount]
 
+    candidates = column[normalized.index]
+    is_int = candidates.str.match(_int_pattern)
+    if is_int.any():
+        result.loc[is_int.index[is_int]] = _to_int(candidates[is_int])
+
+    is_float = ~is_int & numeric.notna()
+    if is_float.any():
+        result.loc[is_float.index[is_float]] = numeric[is_float].astype(object)
+
+    if field_type in NUMERIC_TYPES:
+        is_text = ~(is_int | is_float)
+        failed.loc[is_text.index[is_text]] = True
+
+    return result, failed
 
-def _is_date_field(field_name: str) -> bool:
-    date_keywords = ['date', 'time', 'дата', 'время']
-    return any(keyword in field_name for keyword in date_keywords)
 
+def _parse_dates(values: pd.Series) -> pd.Series:
+    date_format = _guess_date_format(values.iloc[0])
+    if date_format is not None:
+        parsed = pd.to_datetime(values, format=date_format, errors='coerce')
+    else:
+        parsed = pd.Series(pd.NaT, index=values.index)
 
-def validate_entity(data: Dict[str, Any]) -> None:
-    if 'phone' in data:
-        validate_phone(str(data['phone']), 'phone')
+    rest = parsed.isna()
+    if rest.any():
+        # Строки не в формате колонки разбираются поштучно, как раньше
+        parsed[rest] = pd.to_datetime(values[rest], format='mixed', dayfirst=True, errors='coerce')
 
-    if 'email' in data and data['email']:
-        validate_email(data['email'], 'email')
+    return parsed
 
-    date_fields = ['registration_date', 'дата регистрации', 'mark_time', 'время_отметки',
-                   'creation_date', 'дата_создания', 'order_time', 'время_заказа',
-                   'arrival_time', 'время_прибытия', 'payment_date', 'дата_оплаты',
-                   'birthday', 'день_рождения']
 
-    for field in date_fields:
-        if field in data and data[field]:
-            date = datetime.strptime(data[field], "%d.%m.%Y")
-            validate_past_date(date, field)
+def _guess_date_format(value: str):
+    # Даты в выгрузках идут как дд.мм.гггг, но ISO-даты день первым не читаются
+    date_format = guess_datetime_format(value, dayfirst=True)
+    if date_format is not None and date_format.startswith('%Y'):
+        date_format = guess_datetime_format(value)
+    return date_format
+
 
-    positive_fields = ['distance_m', 'расстояние_м', 'passenger_count',
-                       'колво_пассажиров', 'amount', 'сумма']
-    for field in positive_fields:
-        if field in data and data[field] is not None:
-            validate_positive(data[field], field)
+def _to_numbers(column: pd.Series, field_type: type) -> Tuple[pd.Series, pd.Series]:
+    # Числа из CSV приходят текстом, из таблиц - числами и текстом вперемешку:
+    # вся колонка приводится одним pd.to_numeric, нераспознанное значение - ошибка строки
+    present = column.notna()
+    text = column.astype(str).str.strip().str.replace(',', '.', regex=False)
+    numeric = pd.to_numeric(text.where(present), errors='coerce')
+    valid = numeric.notna()
+    if field_type is int:
+        valid &= numeric % 1 == 0
 
-    if 'rating' in data and data['rating'] is not None:
-        if not (1 <= data['rating'] <= 5):
-            raise ValueError(f"Рейтинг должен быть от 1 до 5, получено: {data['rating']}")
+    result = pd.Series(None, index=column.index, dtype=object)
+    if valid.any():
+        values = numeric[valid]
+        result[valid] = (values.astype('int64') if field_type is int else values).astype(object)
+    return result, present & ~valid
+
+
+def _to_int(values: pd.Series) -> pd.Series:
+    try:
+        numbers = pd.to_numeric(values)
+        if numbers.dtype.kind == 'i':
+            return numbers.astype(object)
+    except ValueError:
+        pass
+    # Большие целые не помещаются в int64 без потери точности
+    return values.map(int)
+
+
+def _failure_message(field_name: str) -> str:
+    if _is_date_field(field_name):
+        return f"Поле '{field_name}': не удалось распознать дату"
+    return f"Поле '{field_name}': не удалось распознать число"
+
+
+def _is_date_field(field_name: str) -> bool:
+    date_keywords = ['date', 'time', 'дата', 'время']
+    return field_name in DATE_FIELDS or any(keyword in field_name for keyword in date_keywords)
+
+
+def prepare_frame(df: pd.DataFrame, column_mapping: Dict[str, str],
+                  field_types: Optional[Dict[str, type]] = None) -> TransformResult:
+    with stage('transform', len(df)):
+        result = transform_frame(df, column_mapping, field_types)
+    with stage('validate', len(df)):
+        errors = combine_errors(result.errors, validate_frame(result.data))
+    return TransformResult(result.data, errors)
+
+
+def validate_frame(data: pd.DataFrame) -> pd.Series:
+    checks = []
+
+    if 'phone' in data.columns:
+        phone = data['phone']
+        is_phone = phone.astype(str).str.match(_phone_re.pattern)
+        checks.append(_message(phone.notna() & ~is_phone,
+                               "Поле 'phone' не является номером телефона"))
+
+    if 'email' in data.columns:
+        email = data['email']
+        present = email.notna() & (email != '')
+        is_email = email.str.match(_email_re.pattern, na=False)
+        checks.append(_message(present & ~is_email,
+                               "Поле 'email' не является электронным адресом"))
+
+    now = pd.Timestamp.now()
+    for field in DATE_FIELDS:
+        if field not in data.columns:
+            continue
+        dates = pd.to_datetime(data[field], errors='coerce')
+        checks.append(_message(dates >= now,
+                               f"Поле '{field}' должно находиться в прошлом"))
+
+    for field in POSITIVE_FIELDS:
+        if field not in data.columns:
+            continue
+        present = data[field].notna()
+        numbers = pd.to_numeric(data[field].where(present), errors='coerce')
+        checks.append(_message(present & ~(numbers >= 0),
+                               f"Поле '{field}' должны быть позитивным"))
+
+    if 'rating' in data.columns:
+        rating = data['rating']
+        numbers = pd.to_numeric(rating, errors='coerce')
+        invalid = rating.notna() & ~numbers.between(1, 5)
+        checks.append(("Рейтинг должен быть от 1 до 5, получено: " + rating.astype(str))
+                      .where(invalid, None))
+
+    return combine_errors(pd.Series(None, index=data.index, dtype=object), *checks)
+
+
+def combine_errors(*errors: pd.Series) -> pd.Series:
+    frame = pd.concat(errors, axis=1)
+    failed = frame.notna().any(axis=1)
+
+    combined = pd.Series(None, index=frame.index, dtype=object)
+    if failed.any():
+        combined[failed] = frame[failed].apply(lambda row: '; '.join(row.dropna()), axis=1)
+    return combined
+
+
+def _message(mask: pd.Series, message: str) -> pd.Series:
+    return pd.Series(message, index=mask.index, dtype=object).where(mask, None)
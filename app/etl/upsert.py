@@ -0,0 +1,292 @@
+import logging
+from collections import defaultdict
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple, Type
+
+from sqlalchemy import Integer, String, Table, bindparam, select, text, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import SQLModel
+
+from app.etl.mappings import field_types
+from app.models import Client, Driver, Persona
+
+logger = logging.getLogger(__name__)
+
+# У SQL Server предел 2100 параметров на запрос
+MSSQL_MAX_PARAMS = 2000
+LOOKUP_SIZE = 1000
+
+
+class UpsertResult(NamedTuple):
+    # Ключи записанных строк для кэша внешних ключей и число строк, которых в БД ещё не было
+    keys: List[Tuple[Type[SQLModel], List[Any]]]
+    inserted: int
+
+
+def primary_key_fields(model_class: Type[SQLModel]) -> List[str]:
+    mapper = model_class.__mapper__
+    return [mapper.get_property_by_column(column).key for column in mapper.primary_key]
+
+
+def check_key_fields(model_class: Type[SQLModel], key_fields: Sequence[str]):
+    unknown = [field for field in key_fields if field not in field_types(model_class)]
+    if unknown:
+        raise ValueError(f"Неизвестные поля ключа для таблицы {model_class.__tablename__}: "
+                         f"{', '.join(unknown)}")
+
+    if model_class is Client or model_class is Driver:
+        if _key_owner(model_class, key_fields) is None:
+            raise ValueError(f"Поля ключа должны относиться либо к персоне, "
+                             f"либо к таблице {model_class.__tablename__}")
+
+
+def upsert_batch(session, model_class: Type[SQLModel], rows: List[Dict[str, Any]],
+                 key_fields: Sequence[str]) -> UpsertResult:
+    rows = _last_by_key(rows, key_fields)
+
+    if model_class is Client or model_class is Driver:
+        persona_rows = [_fields(Persona, row) for row in rows]
+
+        owner = _key_owner(model_class, key_fields)
+        if owner is Persona:
+            _resolve_primary_keys(session, Persona, persona_rows, key_fields)
+        else:
+            child_rows = [_fields(model_class, row) for row in rows]
+            _resolve_primary_keys(session, model_class, child_rows, key_fields)
+            for persona_row, child_row in zip(persona_rows, child_rows):
+                persona_row['id'] = child_row.get('id')
+
+        # id новых персон выдаёт БД, клиент/водитель получает тот же id
+        persona_keys, _ = _upsert(session, Persona, persona_rows)
+        persona_ids = [key[0] for key in persona_keys]
+        # Новые и обновлённые строки считаются по клиентам/водителям, а не по персонам
+        _, inserted = _upsert(session, model_class, [
+            {**_fields(model_class, row), 'id': persona_id}
+            for row, persona_id in zip(rows, persona_ids)
+        ])
+        return UpsertResult([(Persona, persona_ids), (model_class, persona_ids)], inserted)
+
+    params = [_fields(model_class, row) for row in rows]
+    if list(key_fields) != primary_key_fields(model_class):
+        _resolve_primary_keys(session, model_class, params, key_fields)
+
+    keys, inserted = _upsert(session, model_class, params)
+    if len(primary_key_fields(model_class)) == 1:
+        return UpsertResult([(model_class, [key[0] for key in keys])], inserted)
+    return UpsertResult([], inserted)
+
+
+def existing_keys(session, model_class: Type[SQLModel], keys: List[Tuple],
+                  key_fields: Sequence[str]) -> Set[Tuple]:
+    # Какие из естественных ключей уже есть в таблице, одним запросом на LOOKUP_SIZE ключей.
+    # Ключ персоны для клиента/водителя ищется среди персон, у которых есть клиент/водитель
+    owner = _key_owner(model_class, key_fields) or model_class
+    key_columns = [owner.__mapper__.columns[field] for field in key_fields]
+
+    found = set()
+    for start in range(0, len(keys), LOOKUP_SIZE):
+        chunk = keys[start:start + LOOKUP_SIZE]
+        if len(key_columns) == 1:
+            condition = key_columns[0].in_([key[0] for key in chunk])
+        else:
+            condition = tuple_(*key_columns).in_(chunk)
+
+        query = select(*key_columns).where(condition)
+        if owner is not model_class:
+            query = query.join(model_class, model_class.id == Persona.id)
+        found.update(tuple(record) for record in session.execute(query))
+    return found
+
+
+def match_returned_keys(records: List[Dict[str, Any]], returned: Sequence[Sequence[Any]],
+                        match_fields: Sequence[str], key_count: int = 1) -> List[Tuple]:
+    # RETURNING без sort_by_parameter_order уходит одной инструкцией, но порядок строк не задан:
+    # ключи сопоставляются строкам по значениям match_fields. Среди одинаковых строк
+    # ключи раздаются по возрастанию, в порядке вставки
+    found = defaultdict(list)
+    for row in returned:
+        found[tuple(row[key_count:])].append(tuple(row[:key_count]))
+    for keys in found.values():
+        keys.sort(reverse=True)
+    return [found[tuple(record[field] for field in match_fields)].pop() for record in records]
+
+
+def _key_owner(model_class: Type[SQLModel], key_fields: Sequence[str]) -> Optional[Type[SQLModel]]:
+    for owner in (Persona, model_class):
+        if all(field in owner.model_fields for field in key_fields):
+            return owner
+    return None
+
+
+def _fields(model_class: Type[SQLModel], data: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: value for field, value in data.items() if field in model_class.model_fields}
+
+
+def _last_by_key(rows: List[Dict[str, Any]], key_fields: Sequence[str]) -> List[Dict[str, Any]]:
+    # Повтор ключа внутри пачки: применяется последняя строка, как и при повторном импорте
+    unique = {}
+    for position, row in enumerate(rows):
+        key = tuple(row.get(field) for field in key_fields)
+        unique[position if None in key else key] = row
+    return list(unique.values())
+
+
+def _resolve_primary_keys(session, model_class: Type[SQLModel], params: List[Dict[str, Any]],
+                          key_fields: Sequence[str]):
+    # Естественный ключ заменяется первичным одним запросом на LOOKUP_SIZE ключей
+    mapper = model_class.__mapper__
+    key_columns = [mapper.columns[field] for field in key_fields]
+    pk_fields = primary_key_fields(model_class)
+
+    keys = list({
+        tuple(row[field] for field in key_fields)
+        for row in params if all(row.get(field) is not None for field in key_fields)
+    })
+
+    found = {}
+    for start in range(0, len(keys), LOOKUP_SIZE):
+        chunk = keys[start:start + LOOKUP_SIZE]
+        if len(key_columns) == 1:
+            condition = key_columns[0].in_([key[0] for key in chunk])
+        else:
+            condition = tuple_(*key_columns).in_(chunk)
+
+        query = select(*mapper.primary_key, *key_columns).where(condition)
+        for record in session.execute(query):
+            found[tuple(record[len(pk_fields):])] = tuple(record[:len(pk_fields)])
+
+    for row in params:
+        primary_key = found.get(tuple(row.get(field) for field in key_fields))
+        if primary_key is not None:
+            row.update(zip(pk_fields, primary_key))
+
+
+def _existing_keys(session, columns: List[Any], keys: List[Tuple]) -> Set[Tuple]:
+    found = set()
+    keys = list(set(keys))
+    for start in range(0, len(keys), LOOKUP_SIZE):
+        chunk = keys[start:start + LOOKUP_SIZE]
+        if len(columns) == 1:
+            condition = columns[0].in_([key[0] for key in chunk])
+        else:
+            condition = tuple_(*columns).in_(chunk)
+        found.update(tuple(record) for record in session.execute(select(*columns).where(condition)))
+    return found
+
+
+def _upsert(session, model_class: Type[SQLModel],
+            params: List[Dict[str, Any]]) -> Tuple[List[Tuple], int]:
+    # Возвращает ключи строк в порядке params и число вставленных (а не обновлённых) строк
+    mapper = model_class.__mapper__
+    fields = [
+        attr.key for attr in mapper.column_attrs
+        if attr.key in primary_key_fields(model_class) or any(attr.key in row for row in params)
+    ]
+
+    # У всех строк одинаковый набор колонок: пустое значение в выгрузке означает NULL
+    records = [
+        {mapper.columns[field].key: _plain(row.get(field)) for field in fields}
+        for row in params
+    ]
+
+    dialect = session.get_bind().dialect.name
+    if dialect == 'mssql':
+        return _merge(session, model_class.__table__, records)
+    if dialect == 'sqlite':
+        return _insert_on_conflict(session, model_class.__table__, records)
+    raise ValueError(f"Режим upsert не поддерживается для СУБД {dialect}")
+
+
+def _plain(value: Any) -> Any:
+    # numpy-скаляры из DataFrame не принимаются драйвером БД
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _insert_on_conflict(session, table: Table, records: List[Dict[str, Any]]) -> Tuple[List[Tuple], int]:
+    statement = sqlite_insert(table)
+    primary_key = list(table.primary_key.columns)
+    update = {
+        key: statement.excluded[key] for key in records[0]
+        if not table.c[key].primary_key
+    }
+
+    if update:
+        statement = statement.on_conflict_do_update(index_elements=primary_key, set_=update)
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=primary_key)
+
+    # Строки с известным ключом: ключ берётся из самой строки
+    key_names = [column.key for column in primary_key]
+    keys = [tuple(record[key] for key in key_names) for record in records]
+    new_rows = [record for record, key in zip(records, keys) if None in key]
+
+    # ON CONFLICT не сообщает, вставлена строка или обновлена: существующие ключи ищутся до записи
+    existing = _existing_keys(session, primary_key, [key for key in keys if None not in key])
+    inserted = sum(1 for key in keys if key not in existing)
+
+    if not new_rows:
+        session.execute(statement, records)
+        return keys, inserted
+
+    # Новым строкам ключ выдаёт БД: RETURNING без сортировки (одна инструкция на пачку),
+    # ключи сопоставляются строкам по строковым колонкам, а если их нет - по всем остальным
+    values = [key for key in records[0] if not table.c[key].primary_key]
+    match = [key for key in values if isinstance(table.c[key].type, String)] or values
+    returned = session.execute(statement.returning(*primary_key, *[table.c[key] for key in match]),
+                               records).all()
+    known = set(keys)
+    created = iter(match_returned_keys(
+        new_rows, [row for row in returned if tuple(row[:len(primary_key)]) not in known],
+        match, len(primary_key)
+    ))
+    return [next(created) if None in key else key for key in keys], inserted
+
+
+def _merge(session, table: Table, records: List[Dict[str, Any]]) -> Tuple[List[Tuple], int]:
+    keys = []
+    inserted = 0
+    per_statement = max(1, MSSQL_MAX_PARAMS // (len(records[0]) + 1))
+    for start in range(0, len(records), per_statement):
+        chunk_keys, chunk_inserted = _merge_chunk(session, table, records[start:start + per_statement])
+        keys.extend(chunk_keys)
+        inserted += chunk_inserted
+    return keys, inserted
+
+
+def _merge_chunk(session, table: Table, records: List[Dict[str, Any]]) -> Tuple[List[Tuple], int]:
+    preparer = session.get_bind().dialect.identifier_preparer
+    columns = [table.c[key] for key in records[0]]
+    primary_key = list(table.primary_key.columns)
+    identity = table.autoincrement_column
+
+    def quote(column):
+        return preparer.quote(column.name)
+
+    params = []
+    rows = []
+    for position, record in enumerate(records):
+        names = [f'p{position}_0']
+        params.append(bindparam(names[0], position, type_=Integer()))
+        for index, column in enumerate(columns, 1):
+            names.append(f'p{position}_{index}')
+            params.append(bindparam(names[-1], record[column.key], type_=column.type))
+        rows.append('(' + ', '.join(f':{name}' for name in names) + ')')
+
+    # Строки без ключа не совпадут ни с чем и будут вставлены, IDENTITY выдаёт им новый id
+    inserted = [column for column in columns if column is not identity]
+    updated = [column for column in columns if not column.primary_key]
+
+    sql = (
+        f"MERGE INTO {preparer.format_table(table)} WITH (HOLDLOCK) AS target "
+        f"USING (VALUES {', '.join(rows)}) "
+        f"AS source (_row, {', '.join(quote(column) for column in columns)}) "
+        f"ON {' AND '.join(f'target.{quote(c)} = source.{quote(c)}' for c in primary_key)} "
+        + (f"WHEN MATCHED THEN UPDATE SET "
+           f"{', '.join(f'target.{quote(c)} = source.{quote(c)}' for c in updated)} "
+           if updated else "")
+        + f"WHEN NOT MATCHED THEN INSERT ({', '.join(quote(c) for c in inserted)}) "
+        f"VALUES ({', '.join(f'source.{quote(c)}' for c in inserted)}) "
+        f"OUTPUT source._row, $action, {', '.join(f'inserted.{quote(c)}' for c in primary_key)};"
+    )
+
+    result = sorted(session.execute(text(sql).bindparams(*params)).all(), key=lambda row: row[0])
+    return [tuple(row[2:]) for row in result], sum(1 for row in result if row[1] == 'INSERT')
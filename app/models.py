@@ -4,12 +4,13 @@ from typing import Optional
 from decimal import Decimal
 
 from fastapi import HTTPException
-from sqlalchemy import Column, Unicode
+from sqlalchemy import Column, Numeric, Unicode
 from sqlalchemy.dialects import mssql
 from sqlmodel import SQLModel, Field, Relationship
 
 
 _phone_re = re.compile(r'^\+?\d{10,15}$')
+_non_digit_re = re.compile(r'\D')
 _email_re = re.compile(r'^\S+?@\S+\.\S+$')
 
 
@@ -26,6 +27,22 @@ def validate_phone(phone: str, key: str):
     return phone
 
 
+def normalize_phone(phone: str) -> str:
+    # Только цифры, российский номер с 8 в начале приводится к 7
+    digits = _non_digit_re.sub('', phone)
+    if len(digits) == 11 and digits.startswith('8'):
+        digits = '7' + digits[1:]
+    return digits
+
+
+def phone_variants(digits: str) -> list[str]:
+    # Написания нормализованного номера, в которых он может храниться в БД
+    variants = [digits, '+' + digits]
+    if len(digits) == 11 and digits.startswith('7'):
+        variants.append('8' + digits[1:])
+    return variants
+
+
 def validate_email(email: str, key: str):
     _check(_email_re.match(email), key, "не является электронным адресом")
     return email
@@ -46,7 +63,7 @@ class Persona(SQLModel, table=True):
 
     id: Optional[int] = Field(default=None, sa_column_kwargs={"name": "id_персоны"}, primary_key=True)
     name: str = Field(sa_column=Column("имя", Unicode(40)))
-    phone: str = Field(sa_column=Column("телефон", Unicode(40)))
+    phone: str = Field(sa_column=Column("телефон", Unicode(40), index=True))
     registration_date: datetime = Field(sa_column_kwargs={"name": "дата_регистрации"})
     birthday: Optional[datetime] = Field(default=None, sa_column_kwargs={"name": "день_рождения"})
 
@@ -181,7 +198,8 @@ class Payment(SQLModel, table=True):
 
     order_id: int = Field(foreign_key='Заказ.id_заказа', sa_column_kwargs={"name": "id_заказа"}, primary_key=True)
     client_id: int = Field(foreign_key='Клиент.id_клиента', sa_column_kwargs={"name": "id_клиента"})
-    amount: Decimal = Field(sa_column=Column("сумма", mssql.MONEY))
+    # MONEY есть только в SQL Server, в других БД (SQLite для замеров ETL) - NUMERIC(19, 4)
+    amount: Decimal = Field(sa_column=Column("сумма", Numeric(19, 4).with_variant(mssql.MONEY(), 'mssql')))
     payment_date: Optional[datetime] = Field(default=None, sa_column_kwargs={"name": "дата_оплаты"})
     payment_type: Optional[str] = Field(default=None, sa_column=Column("тип_оплаты", Unicode(40)))
 
@@ -1,9 +1,10 @@
 from datetime import datetime
 from typing import Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
 
-from app.database import create_entity, get_entities, update_entity, delete_entity
+from app.database import (get_entities, update_entity, session_scope, create_entity_s,
+                          get_entities_s, delete_entity_s, find_persona_s)
 from app.models import Client, Persona, validate_phone, validate_email, validate_past_date
 
 router = APIRouter(prefix="/clients", tags=["clients"])
@@ -12,13 +13,22 @@ router = APIRouter(prefix="/clients", tags=["clients"])
 @router.post("/")
 def create_client(name: str, phone: str, email: Optional[str] = None,
                   surname: Optional[str] = None, birthday: Optional[datetime] = None):
-    persona = Persona(
-        name=name,
-        phone=validate_phone(phone, 'phone'),
-        registration_date=datetime.now(),
-        birthday=birthday
-    )
-    return create_entity(Client(surname=surname, email=email, persona_rel=persona))
+    with session_scope() as session:
+        # Человек с этим телефоном уже есть (например, водитель): клиент привязывается к нему
+        persona = find_persona_s(session, validate_phone(phone, 'phone'))
+        if persona is None:
+            persona = Persona(
+                name=name,
+                phone=phone,
+                registration_date=datetime.now(),
+                birthday=birthday
+            )
+        elif persona.client is not None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Клиент с телефоном {phone} уже существует"
+            )
+        return create_entity_s(session, Client(surname=surname, email=email, persona_rel=persona))
 
 
 @router.get("/")
@@ -51,6 +61,9 @@ def update_client(client_id: int,
 
 @router.delete("/{client_id}")
 def delete_client(client_id: int):
-    delete_entity(Client, client_id)
-    delete_entity(Persona, client_id)
+    with session_scope() as session:
+        delete_entity_s(session, Client, client_id)
+        # Персона остаётся, если этот же человек - водитель
+        if get_entities_s(session, Persona, client_id).driver is None:
+            delete_entity_s(session, Persona, client_id)
     return {"message": "Client deleted"}
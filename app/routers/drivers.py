@@ -1,65 +1,82 @@
 from datetime import datetime
 from typing import Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
 
-from app.database import create_entity, get_entities, update_entity, delete_entity
+from sqlalchemy.orm import selectinload
+
+from app.database import (aget_entities, aupdate_entity, async_session_scope, acreate_entity_s,
+                          aget_entities_s, adelete_entity_s, afind_persona_s)
 from app.models import Driver, Persona, validate_phone, validate_past_date
 
 router = APIRouter(prefix="/drivers", tags=["drivers"])
 
 
 @router.post("/")
-def create_driver(name: str, phone: str, surname: str,
-                  license_number: str, car_id: int):
-    persona = Persona(
-        name=name,
-        phone=validate_phone(phone, 'phone'),
-        registration_date=datetime.now()
-    )
-    return create_entity(Driver(
-        surname=surname,
-        license_number=license_number,
-        is_working=True,
-        car_id=car_id,
-        persona_rel=persona
-    ))
+async def create_driver(name: str, phone: str, surname: str,
+                        license_number: str, car_id: int):
+    async with async_session_scope() as session:
+        # Человек с этим телефоном уже есть (например, клиент): водитель привязывается к нему
+        persona = await afind_persona_s(session, validate_phone(phone, 'phone'))
+        if persona is None:
+            persona = Persona(
+                name=name,
+                phone=phone,
+                registration_date=datetime.now()
+            )
+        elif persona.driver is not None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Водитель с телефоном {phone} уже существует"
+            )
+        return await acreate_entity_s(session, Driver(
+            surname=surname,
+            license_number=license_number,
+            is_working=True,
+            car_id=car_id,
+            persona_rel=persona
+        ))
 
 
 @router.get("/")
-def get_drivers(driver_id: Optional[int] = None):
-    return get_entities(Driver, driver_id)
+async def get_drivers(driver_id: Optional[int] = None):
+    return await aget_entities(Driver, driver_id)
 
 
 @router.put("/{driver_id}")
-def update_driver(driver_id: int,
-                  name: Optional[str] = None,
-                  phone: Optional[str] = None,
-                  surname: Optional[str] = None,
-                  license_number: Optional[str] = None,
-                  is_working: Optional[bool] = None,
-                  car_id: Optional[int] = None,
-                  birthday: Optional[datetime] = None):
+async def update_driver(driver_id: int,
+                        name: Optional[str] = None,
+                        phone: Optional[str] = None,
+                        surname: Optional[str] = None,
+                        license_number: Optional[str] = None,
+                        is_working: Optional[bool] = None,
+                        car_id: Optional[int] = None,
+                        birthday: Optional[datetime] = None):
     driver_data = {
         "surname": surname,
         "license_number": license_number,
         "is_working": is_working,
         "car_id": car_id
     }
-    updated_driver = update_entity(Driver, driver_id, driver_data)
+    updated_driver = await aupdate_entity(Driver, driver_id, driver_data)
 
     persona_data = {
         "name": name,
-        "phone": validate_phone(phone, 'phone'),
-        "birthday": validate_past_date(birthday, 'birthday')
+        "phone": validate_phone(phone, 'phone') if phone is not None else None,
+        "birthday": validate_past_date(birthday, 'birthday') if birthday is not None else None
     }
-    update_entity(Persona, updated_driver.persona_rel.id, persona_data)
+    # id водителя совпадает с id его персоны
+    await aupdate_entity(Persona, updated_driver.id, persona_data)
 
     return updated_driver
 
 
 @router.delete("/{driver_id}")
-def delete_driver(driver_id: int):
-    delete_entity(Driver, driver_id)
-    delete_entity(Persona, driver_id)
+async def delete_driver(driver_id: int):
+    async with async_session_scope() as session:
+        await adelete_entity_s(session, Driver, driver_id)
+        # Персона остаётся, если этот же человек - клиент
+        persona = await aget_entities_s(session, Persona, driver_id, options=[selectinload(Persona.client)])
+        if persona.client is None:
+            await adelete_entity_s(session, Persona, driver_id)
     return {"message": "Driver deleted"}
@@ -4,7 +4,7 @@ from typing import Optional
 
 from fastapi import APIRouter, HTTPException
 
-from app.database import create_entity, update_entity, get_entities, session_scope, get_entities_s, update_entity_s
+from app.database import acreate_entity, aupdate_entity, aget_entities, async_session_scope, aget_entities_s, aupdate_entity_s
 from app.models import Order, Payment, validate_positive, Driver
 
 router = APIRouter(prefix="/orders", tags=["orders"])
@@ -19,7 +19,7 @@ class Status(IntEnum):
 
 
 @router.post("/")
-def create_order(
+async def create_order(
         client_id: int,
         departure_address: str,
         destination_address: str,
@@ -28,7 +28,7 @@ def create_order(
         has_children: bool,
         has_luggage: bool
 ):
-    return create_entity(Order(
+    return await acreate_entity(Order(
         order_time=datetime.now(),
         departure_address=departure_address,
         destination_address=destination_address,
@@ -42,16 +42,16 @@ def create_order(
 
 
 @router.get("/")
-def get_orders(order_id: Optional[int] = None):
-    return get_entities(Order, order_id)
+async def get_orders(order_id: Optional[int] = None):
+    return await aget_entities(Order, order_id)
 
 
 @router.post("/{order_id}/cancel")
-def cancel_order(order_id: int):
-    with session_scope() as session:
-        status = get_entities_s(session, Order, order_id)
+async def cancel_order(order_id: int):
+    async with async_session_scope() as session:
+        status = await aget_entities_s(session, Order, order_id)
         if status == Status.CREATED or status == Status.ASSIGNED:
-            return update_entity_s(session, Order, order_id, {
+            return await aupdate_entity_s(session, Order, order_id, {
                 "status_id": Status.CANCELLED
             })
         else:
@@ -62,26 +62,26 @@ def cancel_order(order_id: int):
 
 
 @router.post("/{order_id}/assign-driver")
-def assign_driver(order_id: int, driver_id: int):
-    driver = get_entities(Driver, driver_id)
+async def assign_driver(order_id: int, driver_id: int):
+    driver = await aget_entities(Driver, driver_id)
     if driver is None or not driver.is_working:
         raise HTTPException(
             status_code=400,
             detail="Указанный водитель не существует или не работает"
         )
-    return update_entity(Order, order_id, {
+    return await aupdate_entity(Order, order_id, {
         "driver_id": driver_id,
         "status_id": Status.ASSIGNED
     })
 
 
 @router.post("/{order_id}/start")
-def start_trip(order_id: int, amount: float, payment_type: str):
-    order = get_entities(Order, order_id)
+async def start_trip(order_id: int, amount: float, payment_type: str):
+    order = await aget_entities(Order, order_id)
     if order.status_id != Status.ASSIGNED:
         raise HTTPException(status_code=400, detail="Заказ не привязан к водителю")
 
-    create_entity(Payment(
+    await acreate_entity(Payment(
         order_id=order_id,
         client_id=order.client_id,
         amount=validate_positive(amount, 'amount'),
@@ -89,14 +89,14 @@ def start_trip(order_id: int, amount: float, payment_type: str):
         payment_date=None
     ))
 
-    return update_entity(Order, order_id, {
+    return await aupdate_entity(Order, order_id, {
         "status_id": Status.IN_PROGRESS
     })
 
 
 @router.post("/{order_id}/finish")
-def finish_trip(order_id: int):
-    return update_entity(Order, order_id, {
+async def finish_trip(order_id: int):
+    return await aupdate_entity(Order, order_id, {
         "status_id": Status.FINISHED,
         "arrival_time": datetime.now()
     })
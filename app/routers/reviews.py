@@ -4,14 +4,14 @@ from typing import Optional
 from fastapi import APIRouter, HTTPException
 from sqlalchemy import select, func
 
-from app.database import create_entity, session_scope, update_entity
+from app.database import acreate_entity, async_session_scope, aupdate_entity
 from app.models import Review
 
 router = APIRouter(prefix="/reviews", tags=["reviews"])
 
 
 @router.post("/")
-def create_review(
+async def create_review(
         author_id: int,
         target_id: int,
         rating: int,
@@ -22,7 +22,7 @@ def create_review(
             status_code=400,
             detail=f"Рейтинг должен быть в диапазоне [1..5]"
         )
-    return create_entity(Review(
+    return await acreate_entity(Review(
         author_id=author_id,
         target_id=target_id,
         rating=rating,
@@ -32,11 +32,11 @@ def create_review(
 
 
 @router.get("/")
-def get_reviews(
+async def get_reviews(
         author_id: Optional[int] = None,
         target_id: Optional[int] = None
 ):
-    with session_scope() as session:
+    async with async_session_scope() as session:
         stmt = select(Review)
 
         if author_id is not None:
@@ -44,13 +44,13 @@ def get_reviews(
         if target_id is not None:
             stmt = stmt.where(Review.target_id == target_id)
 
-        return list(session.scalars(stmt).all())
+        return list((await session.scalars(stmt)).all())
 
 
 @router.get("/average/{persona_id}")
-def get_average_rating(persona_id: int):
-    with session_scope() as session:
-        avg = session.scalar(
+async def get_average_rating(persona_id: int):
+    async with async_session_scope() as session:
+        avg = await session.scalar(
             select(func.avg(Review.rating)).where(
                 Review.target_id == persona_id,
                 Review.rating.isnot(None)
@@ -60,7 +60,7 @@ def get_average_rating(persona_id: int):
 
 
 @router.post("/")
-def update_review(
+async def update_review(
         author_id: int,
         target_id: int,
         rating: int,
@@ -71,7 +71,7 @@ def update_review(
             status_code=400,
             detail=f"Рейтинг должен быть в диапазоне [1..5]"
         )
-    return update_entity(
+    return await aupdate_entity(
         Review,
         {author_id, target_id},
         {
@@ -83,19 +83,19 @@ def update_review(
 
 
 @router.delete("/")
-def delete_review(
+async def delete_review(
         author_id: int,
         target_id: Optional[int] = None
 ):
-    with session_scope() as session:
+    async with async_session_scope() as session:
         stmt = select(Review).where(Review.author_id == author_id)
 
         if target_id is not None:
             stmt = stmt.where(Review.target_id == target_id)
 
-        reviews = list(session.scalars(stmt).all())
+        reviews = list((await session.scalars(stmt)).all())
         for review in reviews:
-            session.delete(review)
-        session.commit()
+            await session.delete(review)
+        await session.commit()
 
         return {"deleted": len(reviews)}
@@ -1,12 +1,25 @@
 import argparse
 import logging
 import sys
+from datetime import datetime
 from pathlib import Path
-from typing import Optional, Dict
-
-from app.etl.extractor import read_file
-from app.etl.loader import ETLStats, validate_data, load_data
-from app.etl.mappings import TABLE_MODELS, COLUMN_MAPPINGS, LINE
+from typing import Optional, Dict, List
+
+from app.etl.extractor import FILE_FORMATS, read_file, read_file_chunks
+from app.etl.batch import DEFAULT_JOBS, ImportJob, read_manifest, run_batch, scan_directory
+from app.etl.benchmark import BENCHMARK_FORMATS, DEFAULT_INVALID_FRACTION, run_benchmark
+from app.etl.checkpoint import CHECKPOINT_MIN_BYTES, Checkpoint
+from app.etl.error_sink import ErrorSink
+from app.etl.exporter import EXPORT_BATCH_ROWS, EXPORT_FORMATS, export_table
+from app.etl.foreign_keys import ForeignKeyCache
+from app.etl.hash_store import HASH_STORE_NAME, HashStore, default_hash_store_path
+from app.etl.loader import ETLStats, validate_data, load_data, DEFAULT_BATCH_SIZE
+from app.etl.personas import PersonaIndex
+from app.etl.pipeline import run_pipeline
+from app.etl.profiling import RunProfile, profiled, stage, timed_chunks
+from app.etl.upsert import check_key_fields, primary_key_fields
+from app.etl.mappings import TABLE_MODELS, COLUMN_MAPPINGS, LINE, file_dtypes
+from app.models import Client, Driver
 
 logging.basicConfig(
     level=logging.INFO,
@@ -18,14 +31,26 @@ logger = logging.getLogger(__name__)
 def run_etl(file_path: str, table_name: str,
             file_format: Optional[str] = None,
             column_mapping: Optional[Dict[str, str]] = None,
-            validate_only: bool = False) -> ETLStats:
+            validate_only: bool = False,
+            batch_size: int = DEFAULT_BATCH_SIZE,
+            chunk_size: Optional[int] = None,
+            workers: int = 1,
+            writers: int = 1,
+            fk_cache: Optional[ForeignKeyCache] = None,
+            mode: str = 'insert',
+            upsert_key: Optional[List[str]] = None,
+            incremental: bool = False,
+            hash_store_path: Optional[str] = None,
+            resume: bool = False,
+            checkpoints: bool = False,
+            use_cache: bool = True,
+            reject_path: Optional[str] = None) -> ETLStats:
     logger.info(f"- Файл: {file_path}")
     logger.info(f"- Таблица: {table_name}")
-    logger.info(f"- Режим: {'валидация' if validate_only else 'загрузка'}")
+    logger.info(f"- Режим: {'валидация' if validate_only else mode}")
 
-    df = read_file(file_path, file_format)
-    logger.info(f"Прочитано строк: {len(df)}, колонок: {len(df.columns)}")
-    logger.info(f"Колонки: {', '.join(df.columns)}")
+    if not Path(file_path).exists():
+        raise FileNotFoundError(f"Файл не найден: {file_path}")
 
     model_class = TABLE_MODELS.get(table_name.lower())
     if model_class is None:
@@ -35,16 +60,156 @@ def run_etl(file_path: str, table_name: str,
     if column_mapping is None:
         column_mapping = COLUMN_MAPPINGS.get(model_class, {})
 
-    if validate_only:
-        logger.info("Режим валидации: данные не будут загружены в БД")
-        return validate_data(df, model_class, column_mapping)
+    dtypes = file_dtypes(model_class, column_mapping)
+
+    if incremental and not validate_only and mode != 'upsert':
+        # Изменённые строки нужно обновить, а не вставить повторно
+        logger.info("Инкрементальный импорт выполняется в режиме upsert")
+        mode = 'upsert'
+
+    if mode == 'upsert':
+        upsert_key = upsert_key or primary_key_fields(model_class)
+        check_key_fields(model_class, upsert_key)
+        logger.info(f"- Ключ: {', '.join(upsert_key)}")
+    elif upsert_key:
+        raise ValueError("Ключ задаётся только в режиме upsert")
+
+    hash_store = None
+    if incremental and not validate_only:
+        missing = [field for field in upsert_key if field not in column_mapping.values()]
+        if missing:
+            raise ValueError(f"Для инкрементального импорта ключ должен читаться из файла, "
+                             f"нет полей: {', '.join(missing)}. Укажите ключ через --key")
+        hash_store = HashStore(hash_store_path or default_hash_store_path(file_path),
+                               model_class, upsert_key)
+
+    if fk_cache is None:
+        fk_cache = ForeignKeyCache()
+
+    personas = None
+    if mode == 'insert' and not validate_only and model_class in (Client, Driver):
+        # В режиме upsert персона и так находится по ключу
+        personas = PersonaIndex()
+
+    checkpoint = None
+    state = None
+    skip_rows = 0
+    # Контрольные точки пишутся по запросу и для больших файлов, где перезапуск с начала дорог
+    large = Path(file_path).stat().st_size >= CHECKPOINT_MIN_BYTES
+    if not validate_only and writers == 1 and (checkpoints or resume or large):
+        checkpoint = Checkpoint(file_path, model_class.__tablename__)
+        state = checkpoint.load() if resume else None
+        if state is not None:
+            skip_rows = state['offset']
+    elif resume or (checkpoints and writers > 1):
+        raise ValueError("Контрольные точки и продолжение импорта поддерживаются только "
+                         "с одним потоком записи")
+
+    # Номера строк ошибок нужны только для контрольных точек
+    error_sink = ErrorSink(reject_path, resume_offset=skip_rows, track_rows=checkpoint is not None)
+    if state is not None:
+        stats = ETLStats.restore(state['stats'], error_sink)
     else:
-        return load_data(df, model_class, column_mapping)
+        stats = ETLStats(error_sink)
+
+    try:
+        if chunk_size is not None:
+            chunks = timed_chunks(read_file_chunks(file_path, file_format, chunk_size, dtypes,
+                                                   skip_rows, use_cache))
+        else:
+            with stage('read') as timer:
+                df = read_file(file_path, file_format, dtypes, skip_rows, use_cache)
+                timer.rows = len(df)
+            logger.info(f"Прочитано строк: {len(df)}, колонок: {len(df.columns)}")
+            logger.info(f"Колонки: {', '.join(df.columns)}")
+
+            if workers == 1 and writers == 1:
+                if validate_only:
+                    logger.info("Режим валидации: данные не будут загружены в БД")
+                    return validate_data(df, model_class, column_mapping, stats, fk_cache)
+                else:
+                    stats = load_data(df, model_class, column_mapping, batch_size,
+                                      fk_cache, upsert_key, hash_store, stats, checkpoint, personas)
+                    _finish_checkpoint(checkpoint)
+                    return stats
+
+            chunks = [df]
+
+        stats = run_pipeline(chunks, model_class, column_mapping, validate_only=validate_only,
+                             batch_size=batch_size, workers=workers, writers=writers,
+                             fk_cache=fk_cache, upsert_key=upsert_key, hash_store=hash_store,
+                             stats=stats, checkpoint=checkpoint, personas=personas)
+        _finish_checkpoint(checkpoint)
+        return stats
+    finally:
+        error_sink.close()
+        if hash_store is not None:
+            hash_store.close()
+
+
+def _finish_checkpoint(checkpoint: Optional[Checkpoint]):
+    # Файл дочитан до конца: продолжать больше нечего
+    if checkpoint is not None:
+        checkpoint.clear()
+
+
+def _positive_int(value: str) -> int:
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"Ожидалось положительное число, получено: {value}")
+    return number
+
+
+def _field_list(value: str) -> List[str]:
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    if not fields:
+        raise argparse.ArgumentTypeError(f"Ожидался список полей, получено: {value!r}")
+    return fields
+
+
+def _timestamp(value: str) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Ожидалась дата в формате ГГГГ-ММ-ДД[ ЧЧ:ММ], получено: {value}")
+
+
+def _id_list(value: str) -> List[int]:
+    try:
+        return [int(item) for item in _field_list(value)]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Ожидался список номеров через запятую, получено: {value!r}")
+
+
+def _size_list(value: str) -> List[int]:
+    try:
+        sizes = [int(item) for item in _field_list(value)]
+    except ValueError:
+        sizes = []
+    if not sizes or min(sizes) <= 0:
+        raise argparse.ArgumentTypeError(f"Ожидался список положительных чисел через запятую, получено: {value!r}")
+    return sizes
+
+
+def _format_list(value: str) -> List[str]:
+    formats = _field_list(value)
+    unknown = [file_format for file_format in formats if file_format not in BENCHMARK_FORMATS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Неизвестные форматы: {', '.join(unknown)}. "
+                                         f"Доступные: {', '.join(BENCHMARK_FORMATS)}")
+    return formats
+
+
+def _fraction(value: str) -> float:
+    fraction = float(value)
+    if not 0 <= fraction < 1:
+        raise argparse.ArgumentTypeError(f"Ожидалась доля от 0 до 1, получено: {value}")
+    return fraction
 
 
 def create_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
-        description='ETL для импорта данных в БД Яндекс.Такси',
+        description='ETL для импорта и выгрузки данных БД Яндекс.Такси',
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
 
@@ -71,7 +236,7 @@ def create_parser() -> argparse.ArgumentParser:
     import_parser.add_argument(
         '--format',
         type=str,
-        choices=['csv', 'xlsx', 'xls', 'ods', 'odt'],
+        choices=FILE_FORMATS,
         metavar='FORMAT',
         help='Уточнение формата файла'
     )
@@ -82,6 +247,288 @@ def create_parser() -> argparse.ArgumentParser:
         help='Только валидация данных без загрузки в БД'
     )
 
+    import_parser.add_argument(
+        '--batch-size',
+        type=_positive_int,
+        default=DEFAULT_BATCH_SIZE,
+        metavar='N',
+        help=f'Количество строк в одной пачке вставки (по умолчанию: {DEFAULT_BATCH_SIZE})'
+    )
+
+    import_parser.add_argument(
+        '--chunk-size',
+        type=_positive_int,
+        metavar='N',
+        help='Потоковый режим: читать и загружать файл порциями по N строк'
+    )
+
+    import_parser.add_argument(
+        '--workers',
+        type=_positive_int,
+        default=1,
+        metavar='N',
+        help='Количество процессов для преобразования и валидации (по умолчанию: 1)'
+    )
+
+    import_parser.add_argument(
+        '--writers',
+        type=_positive_int,
+        default=1,
+        metavar='N',
+        help='Количество параллельных соединений для записи в БД (по умолчанию: 1). '
+             'Подходит для таблиц без зависимостей между строками файла'
+    )
+
+    import_parser.add_argument(
+        '--mode',
+        type=str,
+        choices=['insert', 'upsert'],
+        default='insert',
+        help='insert - только вставка (по умолчанию), upsert - вставка или обновление '
+             'строк с совпадающим ключом'
+    )
+
+    import_parser.add_argument(
+        '--key',
+        type=_field_list,
+        metavar='FIELD[,FIELD]',
+        help='Ключ для режима upsert (по умолчанию: первичный ключ таблицы), '
+             'например license_plate или phone'
+    )
+
+    import_parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Загружать только новые и изменённые с прошлого импорта строки '
+             '(сравнение по хэшам содержимого, режим upsert)'
+    )
+
+    import_parser.add_argument(
+        '--hash-store',
+        type=str,
+        metavar='PATH',
+        help=f'Файл хранилища хэшей для --incremental (по умолчанию: {HASH_STORE_NAME} рядом с файлом)'
+    )
+
+    import_parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Не использовать кэш разобранных xlsx/xls/ods файлов'
+    )
+
+    import_parser.add_argument(
+        '--reject-file',
+        type=str,
+        metavar='PATH',
+        help='Записать все отклонённые строки с причиной в файл .jsonl или .csv '
+             '(CSV можно исправить и загрузить повторно)'
+    )
+
+    import_parser.add_argument(
+        '--report',
+        type=str,
+        metavar='PATH',
+        help='Записать JSON-отчёт о прогоне: время и скорость этапов, пик памяти, '
+             'обращения к БД'
+    )
+
+    import_parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Продолжить прерванный импорт с последней контрольной точки '
+             '(только с одним потоком записи)'
+    )
+
+    import_parser.add_argument(
+        '--checkpoint',
+        action='store_true',
+        help=f'Сохранять контрольные точки, чтобы прерванный импорт можно было продолжить '
+             f'через --resume (для файлов от {CHECKPOINT_MIN_BYTES // (1024 * 1024)} МБ - всегда)'
+    )
+
+    batch_parser = subparsers.add_parser(
+        'import-batch',
+        help='Импорт нескольких файлов с учётом зависимостей между таблицами'
+    )
+
+    source_group = batch_parser.add_mutually_exclusive_group(required=True)
+    source_group.add_argument(
+        '-m', '--manifest',
+        type=str,
+        metavar='PATH',
+        help='JSON-манифест: список {"file": ..., "table": ..., "format": ..., "mode": ..., "key": ...}'
+    )
+    source_group.add_argument(
+        '-d', '--dir',
+        type=str,
+        metavar='DIR',
+        help='Каталог с файлами, названными по таблицам (cars.csv, drivers.xlsx, ...)'
+    )
+
+    batch_parser.add_argument(
+        '--jobs',
+        type=_positive_int,
+        default=DEFAULT_JOBS,
+        metavar='N',
+        help=f'Количество одновременных импортов (по умолчанию: {DEFAULT_JOBS})'
+    )
+
+    batch_parser.add_argument(
+        '--batch-size',
+        type=_positive_int,
+        default=DEFAULT_BATCH_SIZE,
+        metavar='N',
+        help=f'Количество строк в одной пачке вставки (по умолчанию: {DEFAULT_BATCH_SIZE})'
+    )
+
+    batch_parser.add_argument(
+        '--chunk-size',
+        type=_positive_int,
+        metavar='N',
+        help='Потоковый режим: читать и загружать файлы порциями по N строк'
+    )
+
+    batch_parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Не использовать кэш разобранных xlsx/xls/ods файлов'
+    )
+
+    export_parser = subparsers.add_parser('export', help='Выгрузка таблицы из БД в файл')
+
+    export_parser.add_argument(
+        '-t', '--table',
+        type=str,
+        required=True,
+        metavar='TABLE',
+        help='Таблица для выгрузки'
+    )
+
+    export_parser.add_argument(
+        '-o', '--output',
+        type=str,
+        required=True,
+        metavar='PATH',
+        help='Файл выгрузки: orders.parquet, orders.csv.gz, ...'
+    )
+
+    export_parser.add_argument(
+        '--format',
+        type=str,
+        choices=EXPORT_FORMATS,
+        metavar='FORMAT',
+        help='Уточнение формата файла (по умолчанию - по расширению)'
+    )
+
+    export_parser.add_argument(
+        '--batch-size',
+        type=_positive_int,
+        default=EXPORT_BATCH_ROWS,
+        metavar='N',
+        help=f'Количество строк, читаемых из БД за раз (по умолчанию: {EXPORT_BATCH_ROWS})'
+    )
+
+    export_parser.add_argument(
+        '--since',
+        type=_timestamp,
+        metavar='DATE',
+        help='Выгружать строки начиная с даты (включительно)'
+    )
+
+    export_parser.add_argument(
+        '--until',
+        type=_timestamp,
+        metavar='DATE',
+        help='Выгружать строки до даты (не включительно)'
+    )
+
+    export_parser.add_argument(
+        '--status',
+        type=_id_list,
+        metavar='ID[,ID]',
+        help='Только заказы с указанными статусами, например 4,5'
+    )
+
+    benchmark_parser = subparsers.add_parser(
+        'benchmark',
+        help='Замер скорости импорта на синтетических данных во временной БД SQLite'
+    )
+
+    benchmark_parser.add_argument(
+        '--rows',
+        type=_size_list,
+        default=[10000],
+        metavar='N[,N]',
+        help='Размеры файлов каждой таблицы, например 10000,100000,1000000 (по умолчанию: 10000)'
+    )
+
+    benchmark_parser.add_argument(
+        '--formats',
+        type=_format_list,
+        default=['csv', 'xlsx', 'ods'],
+        metavar='FORMAT[,FORMAT]',
+        help=f'Форматы файлов: {", ".join(BENCHMARK_FORMATS)} (по умолчанию: csv,xlsx,ods)'
+    )
+
+    benchmark_parser.add_argument(
+        '--invalid',
+        type=_fraction,
+        default=DEFAULT_INVALID_FRACTION,
+        metavar='FRACTION',
+        help=f'Доля испорченных строк (по умолчанию: {DEFAULT_INVALID_FRACTION})'
+    )
+
+    benchmark_parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        metavar='N',
+        help='Начальное значение генератора данных (по умолчанию: 0)'
+    )
+
+    benchmark_parser.add_argument(
+        '--batch-size',
+        type=_positive_int,
+        default=DEFAULT_BATCH_SIZE,
+        metavar='N',
+        help=f'Количество строк в одной пачке вставки (по умолчанию: {DEFAULT_BATCH_SIZE})'
+    )
+
+    benchmark_parser.add_argument(
+        '--chunk-size',
+        type=_positive_int,
+        metavar='N',
+        help='Потоковый режим: читать и загружать файлы порциями по N строк'
+    )
+
+    benchmark_parser.add_argument(
+        '-o', '--output',
+        type=str,
+        default='benchmark.json',
+        metavar='PATH',
+        help='Файл результатов в формате JSON (по умолчанию: benchmark.json)'
+    )
+
+    benchmark_parser.add_argument(
+        '--baseline',
+        type=str,
+        metavar='PATH',
+        help='Результаты другого коммита для сравнения скорости'
+    )
+
+    benchmark_parser.add_argument(
+        '--work-dir',
+        type=str,
+        metavar='DIR',
+        help='Каталог для файлов и БД замера (по умолчанию - временный, удаляется после замера)'
+    )
+
+    benchmark_parser.add_argument(
+        '--timing-only',
+        action='store_true',
+        help='Только замер времени, без диагностического прогона (tracemalloc, обращения к БД по этапам)'
+    )
+
     subparsers.add_parser('list-tables', help='Показать список доступных таблиц')
 
     return parser
@@ -97,27 +544,59 @@ def command_import(args):
     logger.info(f"ИМПОРТ ДАННЫХ")
     logger.info(LINE)
 
+    # Профилирование (tracemalloc, события БД) замедляет импорт, поэтому только по --report
+    profile = RunProfile() if args.report else None
+
     try:
-        stats = run_etl(
-            file_path=args.file,
-            table_name=args.table,
-            file_format=args.format,
-            validate_only=args.validate_only
-        )
+        with profiled(profile):
+            stats = run_etl(
+                file_path=args.file,
+                table_name=args.table,
+                file_format=args.format,
+                validate_only=args.validate_only,
+                batch_size=args.batch_size,
+                chunk_size=args.chunk_size,
+                workers=args.workers,
+                writers=args.writers,
+                mode=args.mode,
+                upsert_key=args.key,
+                incremental=args.incremental,
+                hash_store_path=args.hash_store,
+                resume=args.resume,
+                checkpoints=args.checkpoint,
+                use_cache=not args.no_cache,
+                reject_path=args.reject_file
+            )
 
         print(stats)
 
+        if profile is not None:
+            print(profile)
+            profile.write(args.report, stats, file=args.file, table=args.table, mode=args.mode,
+                          batch_size=args.batch_size, chunk_size=args.chunk_size,
+                          workers=args.workers, writers=args.writers)
+
+        if stats.error_count:
+            logger.info(LINE)
+            logger.info(f"ОШИБКИ ПО КАТЕГОРИЯМ")
+            logger.info(LINE)
+
+            for category, count in stats.error_sink.categories.most_common():
+                logger.error(f"{count:8} - {category}")
+
         logger.info(LINE)
-        logger.info(f"ДЕТАЛИ ОШИБОК ({len(stats.errors)} шт.)")
+        logger.info(f"ДЕТАЛИ ОШИБОК ({stats.error_count} шт.)")
         logger.info(LINE)
 
-        for i, error in enumerate(stats.errors[:50], 1):
+        for i, error in enumerate(stats.errors, 1):
             logger.error(f"[Ошибка {i}] Строка {error['row']}: {error['error']}")
             if error['data']:
                 logger.error(f"  Данные: {error['data']}")
 
-        if len(stats.errors) > 50:
-            logger.info(f"... и еще {len(stats.errors) - 50} ошибок")
+        if stats.error_count > len(stats.errors):
+            logger.info(f"... и еще {stats.error_count - len(stats.errors)} ошибок")
+        if args.reject_file and stats.error_count:
+            logger.info(f"Все отклонённые строки: {args.reject_file}")
 
         if stats.error_count == 0:
             logger.info("Импорт завершен успешно!")
@@ -126,6 +605,11 @@ def command_import(args):
             logger.warning(f"Импорт завершен с ошибками: "
                            f"{stats.success_count} успешно, {stats.error_count} ошибок")
             return 1
+        elif stats.unchanged_count > 0:
+            # Верные строки уже в БД без изменений, загружать было нечего
+            logger.warning(f"Импорт завершен с ошибками: загружать было нечего, "
+                           f"{stats.unchanged_count} без изменений, {stats.error_count} ошибок")
+            return 1
         else:
             logger.error("Импорт завершен с ошибками: ни одна строка не загружена")
             return 2
@@ -135,6 +619,126 @@ def command_import(args):
         return 3
 
 
+def command_import_batch(args):
+    logger.info(LINE)
+    logger.info(f"ПАКЕТНЫЙ ИМПОРТ ДАННЫХ")
+    logger.info(LINE)
+
+    try:
+        jobs = read_manifest(args.manifest) if args.manifest else scan_directory(args.dir)
+
+        # Общий кэш ключей: таблицы-родители читаются из БД один раз на весь пакет
+        fk_cache = ForeignKeyCache()
+
+        def run_import(job: ImportJob) -> ETLStats:
+            return run_etl(
+                file_path=job.file_path,
+                table_name=job.table_name,
+                file_format=job.file_format,
+                batch_size=args.batch_size,
+                chunk_size=args.chunk_size,
+                fk_cache=fk_cache,
+                mode=job.mode,
+                upsert_key=job.upsert_key,
+                use_cache=not args.no_cache
+            )
+
+        report = run_batch(jobs, run_import, args.jobs)
+
+        print(report)
+
+        if report.failed_count == 0 and report.error_count == 0:
+            logger.info("Пакетный импорт завершен успешно!")
+            return 0
+        elif report.success_count > 0:
+            logger.warning(f"Пакетный импорт завершен с ошибками: "
+                           f"{report.success_count} строк загружено, {report.error_count} ошибок, "
+                           f"{report.failed_count} файлов не загружено")
+            return 1
+        elif report.unchanged_count > 0:
+            logger.warning(f"Пакетный импорт завершен с ошибками: загружать было нечего, "
+                           f"{report.unchanged_count} строк без изменений, {report.error_count} ошибок, "
+                           f"{report.failed_count} файлов не загружено")
+            return 1
+        else:
+            logger.error("Пакетный импорт завершен с ошибками: ни одна строка не загружена")
+            return 2
+
+    except Exception as e:
+        logger.error(f"Критическая ошибка: {e}")
+        return 3
+
+
+def command_export(args):
+    logger.info(LINE)
+    logger.info(f"ВЫГРУЗКА ДАННЫХ")
+    logger.info(LINE)
+
+    model_class = TABLE_MODELS.get(args.table.lower())
+    if model_class is None:
+        logger.error(f"Неизвестная таблица: {args.table}. "
+                     f"Доступные: {', '.join(TABLE_MODELS.keys())}")
+        return 1
+
+    try:
+        stats = export_table(
+            model_class,
+            args.output,
+            file_format=args.format,
+            batch_size=args.batch_size,
+            since=args.since,
+            until=args.until,
+            statuses=args.status
+        )
+
+        print(stats)
+        logger.info("Выгрузка завершена успешно!")
+        return 0
+
+    except Exception as e:
+        logger.error(f"Критическая ошибка: {e}")
+        return 3
+
+
+def command_benchmark(args):
+    logger.info(LINE)
+    logger.info(f"ЗАМЕР СКОРОСТИ ИМПОРТА")
+    logger.info(LINE)
+
+    def run_import(file_path: str, table_name: str) -> ETLStats:
+        # Кэш разобранных таблиц отключён: замеряется чтение файла, а не кэша
+        return run_etl(
+            file_path=file_path,
+            table_name=table_name,
+            batch_size=args.batch_size,
+            chunk_size=args.chunk_size,
+            use_cache=False
+        )
+
+    try:
+        report = run_benchmark(
+            run_import,
+            sizes=args.rows,
+            formats=args.formats,
+            invalid_fraction=args.invalid,
+            seed=args.seed,
+            work_dir=args.work_dir,
+            timing_only=args.timing_only,
+            batch_size=args.batch_size,
+            chunk_size=args.chunk_size
+        )
+
+        print(report)
+        if args.baseline:
+            print(report.compare(args.baseline))
+        report.write(args.output)
+        return 0
+
+    except Exception as e:
+        logger.error(f"Критическая ошибка: {e}")
+        return 3
+
+
 def command_list_tables():
     logger.info(LINE)
     logger.info("ДОСТУПНЫЕ ТАБЛИЦЫ ДЛЯ ИМПОРТА")
@@ -160,6 +764,12 @@ def main():
 
     if args.command == 'import':
         exit_code = command_import(args)
+    elif args.command == 'import-batch':
+        exit_code = command_import_batch(args)
+    elif args.command == 'export':
+        exit_code = command_export(args)
+    elif args.command == 'benchmark':
+        exit_code = command_benchmark(args)
     elif args.command == 'list-tables':
         exit_code = command_list_tables()
     else:
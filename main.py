@@ -1,8 +1,27 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
+from app.database import check_indexes, dispose_async_engine, dispose_engine, warm_async_pool, warm_pool
 from app.routers import car_types, clients, drivers, order_statuses, orders, payments, reviews, cars
 
-api = FastAPI(title="Yandex.Taxi", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Индекс по телефону нужен для поиска существующей персоны при создании клиента и водителя,
+    # при его отсутствии в лог пишется предупреждение
+    check_indexes()
+    # Синхронный пул нужен остальным роутерам, асинхронный - заказам, водителям и отзывам
+    warm_pool()
+    await warm_async_pool()
+    try:
+        yield
+    finally:
+        dispose_engine()
+        await dispose_async_engine()
+
+
+api = FastAPI(title="Yandex.Taxi", version="1.0.0", lifespan=lifespan)
 api.include_router(car_types.router)
 api.include_router(cars.router)
 api.include_router(clients.router)
@@ -0,0 +1,10 @@
+-- Индекс по телефону персоны для поиска существующей персоны при создании клиента и водителя
+-- и при импорте. Новая БД получает его из create_all (Persona.phone, index=True),
+-- в существующую БД скрипт применяется один раз:
+--   sqlcmd -S "(localdb)\MSSQLLocalDB" -d TAXI -i migrations/001_persona_phone_index.sql
+IF NOT EXISTS (
+    SELECT 1 FROM sys.indexes
+    WHERE name = N'ix_Персона_телефон' AND object_id = OBJECT_ID(N'dbo.Персона')
+)
+    CREATE INDEX [ix_Персона_телефон] ON [dbo].[Персона] ([телефон]);
+GO